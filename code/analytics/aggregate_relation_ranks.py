@@ -1,82 +1,117 @@
 import csv
 import os
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
+CHUNK_SIZE = 1 << 20  # number of lines to read at once
 
-def read_relation_ranks(filename):
+
+def read_relation_ranks(filename, variance=False, chunk_size=CHUNK_SIZE):
     """
-    Find all ranks for each model for each relation
+    Sum and count all ranks for each model for each relation, reading the file in chunks
     :param filename: .tsv file containing: term1, relation, term2, [rank, score], ...
-    :return: dict of relation -> dict of model name -> list of ranks
+    :param variance: also sum squared ranks
+    :param chunk_size: number of lines to read at once
+    :return: dict of statistic ("sum", "count" and "square" if variance) -> DataFrame of relation x model name
     """
-    relations = {}
     with open(filename, encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter="\t")
-        headers = next(reader)
-        for term1, relation, term2, *rank_scores in tqdm(reader, desc="Reading " + filename, unit=" lines"):
-            for header, rank in zip(headers[3::2], rank_scores[0::2]):
-                if rank:
-                    relations.setdefault(relation, {}).setdefault(header.rpartition("_rank")[0], []).append(float(rank))
-    return relations
-
-
-def update_mean_ranks_and_counts(model_ranks, relation, relation_mean_ranks, relation_counts):
-    relation_mean_ranks[relation] = {model_name: np.mean(ranks) for model_name, ranks in model_ranks.items()}
-    relation_counts[relation] = next(iter(len(ranks) for ranks in model_ranks.values()))
+        headers = next(csv.reader(f, delimiter="\t"))
+    models = [header.rpartition("_rank")[0] for header in headers[3::2]]
+    stats = {}
+    chunks = pd.read_csv(filename, sep="\t", header=0, names=range(len(headers)),
+                         usecols=[1] + list(range(3, len(headers), 2)), dtype={1: str}, keep_default_na=False,
+                         na_values={i: "" for i in range(3, len(headers), 2)}, chunksize=chunk_size)
+    with tqdm(desc="Reading " + filename, unit=" lines") as t:
+        for chunk in chunks:
+            ranks = chunk.set_index(1).astype(float)
+            ranks.columns = models
+            grouped = ranks.groupby(level=0, sort=False)
+            chunk_stats = dict(sum=grouped.sum(), count=grouped.count())
+            if variance:
+                chunk_stats["square"] = (ranks ** 2).groupby(level=0, sort=False).sum()
+            for name, frame in chunk_stats.items():
+                stats[name] = frame if name not in stats else stats[name].add(frame, fill_value=0)
+            t.update(len(chunk))
+    if not stats:
+        stats = {name: pd.DataFrame(columns=models) for name in ("sum", "count") + (("square",) if variance else ())}
+    return stats
 
 
-def average_ranks(relation_ranks, group=None):
+def average_ranks(relation_stats, groups=()):
     """
     Average and count ranks per relation per model
-    :param relation_ranks: dict of relation -> dict of model name -> list of ranks
-    :param group: list of relations to treat as one
-    :return: pair of (dict of relation -> dict of model name -> mean rank,
-                      dict of relation -> num pairs)
+    :param relation_stats: dict of statistic -> DataFrame of relation x model name, from read_relation_ranks
+    :param groups: lists of relations to treat as one each
+    :return: pair of (DataFrame of relation x model name -> mean rank (and "<model name>_var" columns if available),
+                      Series of relation -> num pairs)
     """
-    relation_mean_ranks = {}
-    relation_counts = {}
-    for relation, model_ranks in relation_ranks.items():
-        if relation not in (group or ()):
-            update_mean_ranks_and_counts(model_ranks, relation, relation_mean_ranks, relation_counts)
-    if group:
-        model_ranks = {}
-        for relation in group:
-            for model_name, ranks in relation_ranks[relation].items():
-                model_ranks.setdefault(model_name, []).extend(ranks)
-        update_mean_ranks_and_counts(model_ranks, "+".join(group), relation_mean_ranks, relation_counts)
-    return relation_mean_ranks, relation_counts
+    grouped = {relation for group in groups or () for relation in group}
+    stats = {name: pd.concat([frame.drop(index=[r for r in grouped if r in frame.index])] +
+                             [frame.reindex(group).sum(min_count=1).rename("+".join(group)).to_frame().T
+                              for group in groups or ()])
+             for name, frame in relation_stats.items()}
+    counts = stats["count"]
+    mean_ranks = stats["sum"] / counts.where(counts > 0)
+    if "square" in stats:
+        variances = stats["square"] / counts.where(counts > 0) - mean_ranks ** 2
+        variances.columns = [model + "_var" for model in variances.columns]
+        mean_ranks = pd.concat([mean_ranks, variances], axis=1)
+    # Number of pairs: count of the first model ranking any pair of the relation
+    relation_counts = counts.apply(lambda c: c[c > 0].iloc[0] if (c > 0).any() else 0, axis=1).astype(int)
+    return mean_ranks, relation_counts
 
 
 def write_relation_ranks(relation_ranks, relation_counts, filename):
     """
     Write mean relation ranks and counts to file
-    :param relation_ranks: dict of relation -> dict of model name -> mean rank
-    :param relation_counts: dict of relation -> num pairs
+    :param relation_ranks: DataFrame of relation x model name -> mean rank
+    :param relation_counts: Series of relation -> num pairs
     :param filename: output .tsv file, will contain: relation, count, [mean rank] ...
     """
-    header = ("relation", "count") + tuple(next(iter(relation_ranks.values())).keys())
+    header = ("relation", "count") + tuple(relation_ranks.columns)
     with open(filename, "w", encoding="utf-8", newline="") as f:
         writer = csv.writer(f, delimiter="\t")
         writer.writerow(header)
-        writer.writerows(tqdm(([relation, relation_counts[relation]] + list(model_ranks.values())
-                               for relation, model_ranks in sorted(relation_ranks.items())),
+        writer.writerows(tqdm(([relation, relation_counts[relation]] + ["" if np.isnan(r) else r for r in model_ranks]
+                               for relation, model_ranks in relation_ranks.sort_index().iterrows()),
                               desc="Writing " + filename, unit=" lines"))
 
 
+def aggregate(filename, out_dir, groups=(), variance=False):
+    """
+    Calculate mean ranks for one relation ranks file and write them to out_dir
+    :return: output filename
+    """
+    mean_ranks, counts = average_ranks(read_relation_ranks(filename, variance), groups)
+    out_file = os.path.join(out_dir, os.path.splitext(os.path.basename(filename))[0] + "_mean.tsv")
+    write_relation_ranks(mean_ranks, counts, out_file)
+    return out_file
+
+
 def main(args):
-    relation_ranks = read_relation_ranks(args.relation_ranks)
-    mean_ranks, counts = average_ranks(relation_ranks, args.group)
     os.makedirs(args.out_dir, exist_ok=True)
-    out_file = os.path.join(args.out_dir, os.path.splitext(os.path.basename(args.relation_ranks))[0] + "_mean.tsv")
-    write_relation_ranks(mean_ranks, counts, out_file)
+    if args.jobs == 1 or len(args.relation_ranks) == 1:
+        for filename in args.relation_ranks:
+            aggregate(filename, args.out_dir, args.group, args.variance)
+    else:
+        with ProcessPoolExecutor(min(args.jobs, len(args.relation_ranks))) as executor:
+            for out_file in executor.map(partial(aggregate, out_dir=args.out_dir, groups=args.group,
+                                                 variance=args.variance), args.relation_ranks):
+                print("Wrote '%s'" % out_file)
 
 
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Calculate mean rank in nearest neighbor list for each lexical relation")
-    argparser.add_argument("relation_ranks", help=".tsv file containing: term1, relation, term2, [rank, score], ...")
+    argparser.add_argument("relation_ranks", nargs="+",
+                           help=".tsv files containing: term1, relation, term2, [rank, score], ...")
     argparser.add_argument("-o", "--out-dir", default=".", help="Directory to save report to")
-    argparser.add_argument("-g", "--group", nargs="+", help="Relations to group together")
+    argparser.add_argument("-g", "--group", nargs="+", action="append", default=[],
+                           help="Relations to group together (may be given multiple times, for multiple groups)")
+    argparser.add_argument("-v", "--variance", action="store_true", help="Also calculate the variance of the ranks")
+    argparser.add_argument("-j", "--jobs", type=int, default=1, help="Number of files to process in parallel")
     main(argparser.parse_args())
@@ -6,6 +6,7 @@ from collections import Counter
 import numpy as np
 import spacy
 
+from analytics.pos_cache import PosCache
 from evaluation.benchmark import WORD_BENCHMARKS
 
 nlp = spacy.load("en", disable=("parser", "ner"))  # requires `python -m spacy download en'
@@ -14,6 +15,7 @@ nlp = spacy.load("en", disable=("parser", "ner"))  # requires `python -m spacy d
 def main(args):
     os.makedirs(args.out_dir, exist_ok=True)
     out_file = os.path.join(args.out_dir, "baselines.tsv")
+    pos_cache = PosCache(nlp)
     with open(out_file, "w", encoding="utf-8") as f:
         if args.header_column:
             print("benchmark", end="\t", file=f)
@@ -30,7 +32,8 @@ def main(args):
                                   dtype=float)
             score_counts = Counter(bin_scores)
             majority_baseline = np.array([max(score_counts, key=score_counts.get)] * len(bin_scores), dtype=float)
-            pos1, pos2 = [[doc[0].pos for doc in nlp.pipe(t)] for t in (terms1, terms2)]
+            pos_cache.tag(terms1 + terms2, desc=benchmark.name)
+            pos1, pos2 = [list(map(pos_cache.pos, t)) for t in (terms1, terms2)]
             pos_baseline = np.array([p1 == p2 for p1, p2 in zip(pos1, pos2)], dtype=float)
             accuracies = [np.mean(baseline == bin_scores) for baseline in (majority_baseline, pos_baseline)]
             print(*accuracies, sep="\t", file=f)
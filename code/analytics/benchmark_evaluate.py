@@ -4,31 +4,48 @@ import os
 from argparse import ArgumentParser
 from glob import glob
 
-from tqdm import tqdm
+import numpy as np
+import pandas as pd
 
-from evaluation.benchmark import WORD_BENCHMARKS, spearman
+from evaluation.benchmark import WORD_BENCHMARKS, WORD_COLUMNS, spearman_columns
 
 
 def read_similarities(filename):
     """
-    Calculate vector of similarities per model
+    Read similarities of all models into one matrix
     :param filename: .tsv file containing: term1, term2, [score by each model], ...
-    :return: dict of model name -> array of similarities
+    :return: DataFrame of (term1, term2) pairs, matrix of similarities (pairs x models, NaN where missing),
+             list of model names
     """
+    logging.info("Reading " + filename)
     with open(filename, encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter="\t")
-        headers = next(reader)
-        rows = list(reader)
-        model_scores = {}
-        for term1, term2, *scores in tqdm(rows, desc="Reading " + filename, unit=" lines"):
-            for header, score in zip(headers[2:], scores):
-                if score:
-                    model_name = header.rpartition("_score")[0]
-                    try:
-                        model_scores.setdefault(model_name, {})[(term1, term2)] = float(score)
-                    except ValueError as e:
-                        raise IOError("Invalid line in %s: %s" % (filename, "\t".join((term1, term2, score)))) from e
-        return model_scores
+        headers = next(csv.reader(f, delimiter="\t"))
+    df = pd.read_csv(filename, sep="\t", dtype={h: str for h in headers[:2]}, keep_default_na=False,
+                     na_values={h: [""] for h in headers[2:]})
+    for i in range(2, len(headers)):
+        column = df.iloc[:, i]
+        if not np.issubdtype(column.dtype, np.number):
+            row = (pd.to_numeric(column, errors="coerce").isna() & column.notna()).idxmax()
+            raise IOError("Invalid line in %s: %s" % (filename, "\t".join(df.iloc[row, [0, 1, i]])))
+    pairs = df.iloc[:, :2].set_axis(WORD_COLUMNS, axis=1)
+    scores = df.iloc[:, 2:].to_numpy(dtype=float)
+    has_scores = ~np.isnan(scores).all(axis=0)
+    model_names = [header.rpartition("_score")[0] for header in headers[2:]]
+    return pairs, scores[:, has_scores], [name for name, has in zip(model_names, has_scores) if has]
+
+
+def align_similarities(gold, pairs, scores):
+    """
+    Join similarities to gold pairs
+    :param gold: DataFrame with WORD_COLUMNS
+    :param pairs: DataFrame with WORD_COLUMNS, from read_similarities
+    :param scores: matrix of similarities (pairs x models), from read_similarities
+    :return: matrix of similarities (gold pairs x models), with 0 where missing
+    """
+    # For a pair listed more than once, take the last value of each model separately, skipping missing ones
+    rows = pd.concat([pairs.reset_index(drop=True), pd.DataFrame(scores)], axis=1)
+    last = rows.groupby(WORD_COLUMNS, sort=False).last()
+    return np.nan_to_num(last.reindex(pd.MultiIndex.from_frame(gold[WORD_COLUMNS])).to_numpy(dtype=float))
 
 
 def main(args):
@@ -39,16 +56,15 @@ def main(args):
             for benchmark in WORD_BENCHMARKS:
                 if args.header_column:
                     print(benchmark.name, end="\t", file=f)
-                pairs = list(benchmark.load(verbose=False).itertuples(index=False))
-                _, _, gold_scores = zip(*pairs)
+                gold = benchmark.load(verbose=False)
                 benchmark_pattern = os.path.join(os.path.dirname(pattern),
                                                  "_".join((benchmark.name, os.path.basename(pattern))))
                 for filename in glob(benchmark_pattern) or [benchmark_pattern]:
                     logging.info(filename)
-                    model_scores = read_similarities(filename)
-                    for model_name, scores in tqdm(sorted(model_scores.items()), desc="Analyzing", unit="model"):
-                        pred_scores = [scores.get(p[:2], 0) for p in pairs]
-                        print(spearman(pred_scores, gold_scores), end="\t", file=f)
+                    pairs, scores, model_names = read_similarities(filename)
+                    correlations = spearman_columns(align_similarities(gold, pairs, scores), gold["score"].values)
+                    for i in np.argsort(model_names, kind="stable"):
+                        print(correlations[i], end="\t", file=f)
                 print(file=f)
         logging.info("Wrote '%s'" % out_file)
 
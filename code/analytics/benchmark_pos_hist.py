@@ -4,20 +4,18 @@ from argparse import ArgumentParser
 
 import spacy
 from scipy.stats import hypergeom
-from tqdm import tqdm
 
+from analytics.pos_cache import PosCache
 from evaluation.benchmark import BENCHMARKS
 
 nlp = spacy.load("en")  # requires `python -m spacy download en'
 
 
-def pos_set_per_pair(pairs, desc):
+def pos_set_per_pair(pairs, desc, pos_cache=None):
     """Get POS for each pair"""
-    pos = [set() for _ in range(len(pairs))]
-    t = tqdm(((x, i) for i, p in enumerate(pairs) for x in p[:2]), desc=desc, unit=" terms", leave=False)
-    for doc, i in nlp.pipe(t, as_tuples=True):
-        pos[i].add(doc[0].pos_)
-    return pos
+    pos_cache = pos_cache or PosCache(nlp)
+    pos_cache.tag((x for p in pairs for x in p[:2]), desc=desc)
+    return [{pos_cache.pos(x) for x in p[:2]} for p in pairs]
 
 
 def find_related_unrelated_indices(pairs):
@@ -41,9 +39,10 @@ def main(args):
     with open(os.path.join(args.out_dir, "benchmark_same_pos.csv"), "a", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(("benchmark", "related", "same_pos_related", "unrelated", "same_pos_unrelated", "pval"))
+        pos_cache = PosCache(nlp)
         for benchmark in BENCHMARKS:
             pairs = list(benchmark.load(verbose=False).itertuples(index=False))
-            pos = pos_set_per_pair(pairs, desc=benchmark.name)
+            pos = pos_set_per_pair(pairs, desc=benchmark.name, pos_cache=pos_cache)
             related, unrelated = find_related_unrelated_indices(pairs)
             same_pos_related, same_pos_unrelated = [sum(1 for i in x if len(pos[i]) == 1) for x in (related, unrelated)]
             pval = hypergeom.sf(same_pos_related - 1, len(related) + len(unrelated),
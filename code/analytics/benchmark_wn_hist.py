@@ -3,20 +3,23 @@ import os
 from argparse import ArgumentParser
 
 from analytics.wn_hist import find_relations
+from analytics.wn_index import load_index
 from evaluation.benchmark import BENCHMARKS
 
 
 def main(args):
     os.makedirs(args.out_dir, exist_ok=True)
+    index = load_index(args.wn_index)
     for benchmark in BENCHMARKS:
         pairs = list(benchmark.load().iloc[:, :2].itertuples(index=False))
         # pprint(relation_hist(pairs))
         filename = benchmark.name + "_wordnet_relations.csv"
         with open(os.path.join(args.out_dir, filename), "w", encoding="utf-8", newline="") as f:
-            csv.writer(f).writerows(tuple(pair) + tuple(find_relations(pair)) for pair in pairs)
+            csv.writer(f).writerows(tuple(pair) + tuple(find_relations(pair, index=index)) for pair in pairs)
 
 
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Calculate WordNet relations on all word similarity benchmark pairs")
     argparser.add_argument("--out-dir", default="reports")
+    argparser.add_argument("--wn-index", help="Directory of WordNet index built by analytics.wn_index, to use if given")
     main(argparser.parse_args())
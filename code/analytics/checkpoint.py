@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import time
+
+from evaluation.cache import atomic_write, strings_digest
+
+INTERVAL = 60  # seconds between checkpoints
+
+
+class Checkpoint:
+    """
+    Progress of writing an output file in order, one unit of work (e.g. pivot word) at a time, to resume from if the
+    run is interrupted. Saved next to the output file, with the number of units done, the output file size after them,
+    and a signature of the inputs, so that a checkpoint is never resumed with different inputs.
+    """
+    def __init__(self, filename, signature, interval=INTERVAL):
+        """
+        :param filename: output file
+        :param signature: list of strings identifying the inputs and options
+        :param interval: minimal number of seconds between saves
+        """
+        self.filename = filename
+        self.checkpoint_filename = filename + ".checkpoint.json"
+        self.signature = strings_digest(signature)
+        self.interval = interval
+        self.done = self.offset = 0
+        self.last = None
+        self.saved = time.time()
+
+    def open(self, resume=False):
+        """
+        Open the output file for writing, truncated to the checkpoint offset if resuming, or empty otherwise
+        :param resume: continue from the checkpoint, if there is one
+        :return: file object
+        """
+        if resume:
+            try:
+                with open(self.checkpoint_filename, encoding="utf-8") as f:
+                    state = json.load(f)
+            except IOError:
+                print("No checkpoint found for '%s', starting over" % self.filename, file=sys.stderr)
+            else:
+                if state["signature"] != self.signature:
+                    raise ValueError("Checkpoint '%s' is for different inputs" % self.checkpoint_filename)
+                if not os.path.exists(self.filename):
+                    raise ValueError("'%s' is missing, but has a checkpoint" % self.filename)
+                if os.path.getsize(self.filename) < state["offset"]:
+                    raise ValueError("'%s' is shorter than its checkpoint" % self.filename)
+                self.done, self.offset, self.last = state["done"], state["offset"], state["last"]
+                print("Resuming '%s' after %d done (last: %s)" % (self.filename, self.done, self.last))
+                f = open(self.filename, "r+", encoding="utf-8", newline="")
+                f.truncate(self.offset)
+                f.seek(self.offset)
+                return f
+        return open(self.filename, "w", encoding="utf-8", newline="")
+
+    def update(self, f, last=None):
+        """
+        Mark one more unit as done, with its output written to f, saving the checkpoint if enough time has passed
+        :param f: output file object
+        :param last: description of the unit, for reporting
+        """
+        self.done += 1
+        self.last = last
+        if time.time() - self.saved >= self.interval:
+            self.save(f)
+
+    def save(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        self.offset = f.tell()
+        with atomic_write(self.checkpoint_filename, "w", encoding="utf-8") as cf:
+            json.dump(dict(signature=self.signature, done=self.done, offset=self.offset, last=self.last), cf)
+        self.saved = time.time()
+
+    def remove(self):
+        """Remove the checkpoint, once the output is complete"""
+        if os.path.exists(self.checkpoint_filename):
+            os.remove(self.checkpoint_filename)
@@ -1,10 +1,13 @@
 import csv
 import os
 from argparse import ArgumentParser
+from array import array
 
 import numpy as np
 from tqdm import tqdm
 
+from evaluation.cache import atomic_write
+
 
 def read_relations(filename):
     with open(filename, encoding="utf-8") as f:
@@ -20,24 +23,146 @@ def read_word_enums(filenames):
     return word_enums
 
 
-def main(args):
-    # Read relations CSV
-    relation_enum = get_unique_relations(args.relations, args.relation_titles, args.out_dir)
+class RelationTensor:
+    """
+    Sparse boolean tensor of relations between word pairs, of shape (|list1|, |list2|, |relations|), in coordinate
+    format: the (i, j, r) of every relation of every pair, sorted.
+    """
+    def __init__(self, shape, i, j, r):
+        self.shape = tuple(map(int, shape))
+        self.i, self.j, self.r = i, j, r
+        self.keys = self.pair_keys(i, j)
+
+    @classmethod
+    def from_coords(cls, shape, i, j, r):
+        """Create from unsorted coordinates, possibly with duplicates"""
+        i, j, r = (np.asarray(a, dtype=np.int64) for a in (i, j, r))
+        entries = np.unique((i * shape[1] + j) * shape[2] + r)
+        pair_keys, r = np.divmod(entries, shape[2])
+        i, j = np.divmod(pair_keys, shape[1])
+        return cls(shape, i.astype(np.int32), j.astype(np.int32), r.astype(np.int32))
+
+    @classmethod
+    def load(cls, filename):
+        """Load from .npz file saved by save, or containing a dense "relations" array (older compress_relations_file)"""
+        with np.load(filename) as f:
+            if "relations" in f:
+                dense = f["relations"]
+                return cls(dense.shape, *(a.astype(np.int32) for a in np.nonzero(dense)))
+            return cls(f["shape"], f["i"], f["j"], f["r"])
+
+    def save(self, filename):
+        np.savez_compressed(filename, shape=self.shape, i=self.i, j=self.j, r=self.r)
+
+    def pair_keys(self, i, j):
+        return np.asarray(i, dtype=np.int64) * self.shape[1] + j
+
+    def totals(self):
+        """:return: number of pairs with each relation"""
+        return np.bincount(self.r, minlength=self.shape[2])
+
+    def select(self, i, j):
+        """
+        Find the relations of given distinct pairs
+        :param i: array of row indices
+        :param j: array of column indices
+        :return: for each relation of any of the pairs: the index of the pair in the given arrays, and the relation
+        """
+        keys = self.pair_keys(i, j)
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        positions = np.minimum(np.searchsorted(sorted_keys, self.keys), max(len(keys) - 1, 0))
+        found = sorted_keys[positions] == self.keys if len(keys) else np.zeros(len(self.keys), dtype=bool)
+        return order[positions[found]], self.r[found]
+
+    def counts(self, i, j):
+        """:return: number of the given distinct pairs with each relation"""
+        return np.bincount(self.select(i, j)[1], minlength=self.shape[2])
+
+    def relation_pairs(self, r):
+        """:return: row and column indices of the pairs with relation r, sorted"""
+        mask = self.r == r
+        return self.i[mask], self.j[mask]
+
+    def relations_of(self, i, j):
+        """:return: relation indices of the pair (i, j)"""
+        key = self.pair_keys(i, j)
+        return self.r[np.searchsorted(self.keys, key, side="left"):np.searchsorted(self.keys, key, side="right")]
 
-    # Read word lists
+
+class RelationPairs:
+    """
+    Pairs of each relation in a RelationTensor: pairs of relation r are (i[k], j[k]) for offsets[r] <= k < offsets[r+1],
+    sorted. Cached next to the relations file, and rebuilt if it changed (by mtime and size).
+    """
+    def __init__(self, shape, offsets, i, j):
+        self.shape = tuple(map(int, shape))
+        self.offsets, self.i, self.j = offsets, i, j
+
+    @classmethod
+    def from_tensor(cls, tensor):
+        order = np.argsort(tensor.r, kind="stable")  # entries are sorted by pair, so each relation's pairs stay sorted
+        offsets = np.concatenate([[0], np.cumsum(tensor.totals())])
+        return cls(tensor.shape, offsets, tensor.i[order], tensor.j[order])
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: .npz file of relations, from compress_relations_file
+        :return: RelationPairs, from the cached index if it is up to date
+        """
+        stat = os.stat(filename)
+        index_file = os.path.splitext(filename)[0] + ".pairs.npz"
+        try:
+            with np.load(index_file) as f:
+                if f["mtime"] == stat.st_mtime_ns and f["size"] == stat.st_size:
+                    return cls(f["shape"], f["offsets"], f["i"], f["j"])
+        except (IOError, KeyError, ValueError):
+            pass
+        pairs = cls.from_tensor(RelationTensor.load(filename))
+        try:
+            with atomic_write(index_file) as f:
+                np.savez(f, mtime=stat.st_mtime_ns, size=stat.st_size, shape=pairs.shape, offsets=pairs.offsets,
+                         i=pairs.i, j=pairs.j)
+        except OSError:  # read-only directory: just use the index built now
+            pass
+        return pairs
+
+    def relation_pairs(self, r):
+        """:return: row and column indices of the pairs with relation r, sorted"""
+        return self.i[self.offsets[r]:self.offsets[r + 1]], self.j[self.offsets[r]:self.offsets[r + 1]]
+
+
+def main(args):
+    os.makedirs(args.out_dir, exist_ok=True)
     word_enums = read_word_enums(args.words)
-    array = np.zeros((len(word_enums[0]), len(word_enums[1]), len(relation_enum)), dtype=bool)
+    relation_enum = get_unique_relations(relation_titles=args.relation_titles)
+    discover = not relation_enum  # Not given, so assign IDs in order of appearance and sort at the end
+    if discover:
+        relation_enum = {}
+    coords = array("i"), array("i"), array("i")
     for word1, word2, relations in read_relations(args.relations):
+        if discover:  # every relation in the file, including those with no pair in the word lists
+            for relation in relations:
+                relation_enum.setdefault(relation, len(relation_enum))
         if word2 in word_enums[0]:  # Always word1 is from the first list and word2 from the second, so swap
             word1, word2 = word2, word1
         i = word_enums[0].get(word1)
         j = word_enums[1].get(word2)
         if i is not None and j is not None:
             for relation in relations:
-                array[i, j, relation_enum[relation]] = True
+                for coord, x in zip(coords, (i, j, relation_enum[relation])):
+                    coord.append(x)
+    i, j, r = (np.frombuffer(coord, dtype=np.int32) for coord in coords)
+    if discover:
+        relation_list = sorted(relation_enum)
+        sorted_ids = {relation: r for r, relation in enumerate(relation_list)}
+        r = np.array([sorted_ids[relation] for relation in relation_enum], dtype=np.int32)[r]
+        save_relation_titles(relation_list, args.out_dir)
+    tensor = RelationTensor.from_coords(tuple(map(len, word_enums)) + (len(relation_enum),), i, j, r)
     array_file = os.path.join(args.out_dir, "relations.npz")
-    np.savez_compressed(array_file, relations=array)
-    print("Saved array to '%s'" % array_file)
+    tensor.save(array_file)
+    print("Saved %d relations of %d pairs to '%s'" % (len(tensor.r), len(np.unique(tensor.keys)), array_file))
 
 
 def get_unique_relations(relations=None, relation_titles=None, out_dir=None):
@@ -53,14 +178,18 @@ def get_unique_relations(relations=None, relation_titles=None, out_dir=None):
                                                             read_relations(relations)
                                                             for relation in relations)))))
     if out_dir:
-        os.makedirs(out_dir, exist_ok=True)
-        relations_file = os.path.join(out_dir, "relations.txt")
-        with open(relations_file, "w", encoding="utf-8") as f:
-            f.writelines(map("{}\n".format, sorted(relation_enum, key=relation_enum.get)))
-        print("Saved unique relations to '%s'" % relations_file)
+        save_relation_titles(sorted(relation_enum, key=relation_enum.get), out_dir)
     return relation_enum
 
 
+def save_relation_titles(relation_list, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    relations_file = os.path.join(out_dir, "relations.txt")
+    with open(relations_file, "w", encoding="utf-8") as f:
+        f.writelines(map("{}\n".format, relation_list))
+    print("Saved unique relations to '%s'" % relations_file)
+
+
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Read CSV file with semantic relations between pairs, and save as matrix")
     argparser.add_argument("words", nargs=2, help="Text files containing words to use for ordering")
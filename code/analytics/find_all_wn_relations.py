@@ -4,22 +4,44 @@ from argparse import ArgumentParser
 
 from tqdm import tqdm
 
+from analytics.checkpoint import Checkpoint
+from analytics.wn_index import load_index
 from analytics.wn_relations import gen_related, DIRECT_RELATIONS
 
 
+def gen_related_names(word, relations, pos, index=None):
+    """
+    :param word: word to find related words for
+    :param relations: relations to include
+    :param pos: parts of speech of related lemmas to include
+    :param index: WordNetIndex to look up the word in, falling back to NLTK if it is not there
+    :return: generator of (relation, set of names of related single-word lemmas)
+    """
+    related = index.related(word, relations) if index else None
+    if related is None:
+        for relation, lemmas in gen_related(word, relations):
+            yield relation, {l.name() for l in lemmas if l.synset().pos() in pos and "_" not in l.name()}
+    else:
+        for relation, ids in related:
+            yield relation, {index.names[i] for i in ids if index.pos[i] in pos and "_" not in index.names[i]}
+
+
 def main(args):
     with open(args.words, encoding="utf-8") as f:
         words = list(map(str.strip, f.readlines()))
+    index = load_index(args.wn_index)
     relations_file = args.out_file or os.path.splitext(args.words)[0] + "_relations.csv"
-    t = tqdm(((w, r.rstrip("s"), rw) for w in words for r, ls in gen_related(w, args.relations)
-              for rw in sorted(set([l.name() for l in ls
-                                    if l.synset().pos() in args.pos and "_" not in l.name()]) - {w})),
-             desc="Writing '%s'" % relations_file, unit=" pairs")
-    with open(relations_file, "w", encoding="utf-8", newline="") as f:
+    checkpoint = Checkpoint(relations_file, words + ["--relations"] + list(args.relations) + ["--pos"] + args.pos)
+    with checkpoint.open(args.resume) as f:
         writer = csv.writer(f)
-        for word, relation, related_word in t:
-            t.set_postfix(word=word, relation=relation, related=related_word)
-            writer.writerow((word, relation, related_word))
+        t = tqdm(words[checkpoint.done:], desc="Writing '%s'" % relations_file, unit=" words",
+                 initial=checkpoint.done, total=len(words))
+        for word in t:
+            t.set_postfix(word=word)
+            for relation, names in gen_related_names(word, args.relations, args.pos, index):
+                writer.writerows((word, relation.rstrip("s"), related_word) for related_word in sorted(names - {word}))
+            checkpoint.update(f, word)
+    checkpoint.remove()
 
 
 if __name__ == "__main__":
@@ -30,4 +52,6 @@ if __name__ == "__main__":
                            help="Relations to extract")
     argparser.add_argument("-p", "--pos", nargs="+", choices="navr", default=["n"],
                            help="Parts of speech of related words to include")
+    argparser.add_argument("--wn-index", help="Directory of WordNet index built by analytics.wn_index, to use if given")
+    argparser.add_argument("--resume", action="store_true", help="Continue from the checkpoint of an interrupted run")
     main(argparser.parse_args())
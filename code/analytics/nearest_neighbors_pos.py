@@ -10,6 +10,8 @@ from operator import itemgetter
 import spacy
 from tqdm import tqdm
 
+from analytics.pos_cache import PosCache
+
 nlp = spacy.load("en", disable=("parser", "ner"))  # requires `python -m spacy download en'
 
 
@@ -66,6 +68,7 @@ def hist_per_term1(neighbors, num_terms):
 
 
 def main(args):
+    pos_cache = PosCache(nlp)
     for pattern in args.nearest_neighbors:
         for filename in glob(pattern) or [pattern]:
             logging.info(filename)
@@ -73,6 +76,8 @@ def main(args):
             neighbors_per_term = args.neighbors if args.exact else None
             model_neighbors = read_nearest_neighbors(filename, neighbors_per_term)
             num_terms = len(set(term1 for neighbors in model_neighbors.values() for _, term1, _ in neighbors))
+            pos_cache.tag((term2 for neighbors in model_neighbors.values() for _, _, term2 in neighbors),
+                          desc="Tagging " + filename)
             hists = []
             for model_name, neighbors in tqdm(sorted(model_neighbors.items()), desc="Analyzing", unit="model"):
                 num_neighbors = num_terms * args.neighbors
@@ -80,8 +85,7 @@ def main(args):
                 logging.info("Using total of %d neighbors for %d terms (average %.1f neighbors per term) for %s" % (
                     len(sorted_neighbors), num_terms, len(sorted_neighbors) / num_terms, model_name))
                 hists.append(hist_per_term1(neighbors, num_terms))
-                pos_hists[model_name] = Counter(doc[0].pos_ for doc in nlp.pipe(
-                    term2 for score, term1, term2 in sorted_neighbors))
+                pos_hists[model_name] = Counter(pos_cache.pos(term2) for score, term1, term2 in sorted_neighbors)
             logging.info("\n".join(["Histograms for number of neighbors per term1:"] +
                                    ["\t".join(map(str, [i] + [hist[i] for i in range(max(hist) + 1)]))
                                     for i, hist in enumerate(hists, start=1)]))
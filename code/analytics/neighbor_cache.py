@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from evaluation.cache import cache_filename, strings_digest
+
+QUEUE_SIZE = 4  # number of queries to keep pending per worker
+COLUMNS = ["word", "model", "fingerprint", "neighbors"]
+
+
+def model_fingerprints(configuration, models):
+    """
+    Fingerprint each model by the whole configuration (which includes the number of neighbors to return) and, if the
+    model name is a file path, the modification time and size of the file
+    :param configuration: JSON configuration of NearestNeighborsModels
+    :param models: model names
+    :return: dict of model name -> fingerprint
+    """
+    config = json.dumps(configuration, sort_keys=True)
+    fingerprints = {}
+    for model in models:
+        stat = os.stat(model) if os.path.isfile(model) else None
+        fingerprints[model] = strings_digest([config, model] + ([str(stat.st_mtime_ns), str(stat.st_size)]
+                                                                if stat else []))
+    return fingerprints
+
+
+class NeighborCache:
+    """
+    Persistent cache of nearest neighbor query results, per model and word, in an SQLite database shared by scripts.
+    Each entry records the fingerprint of its model (see model_fingerprints), and is not served once the model changes.
+    """
+    def __init__(self, fingerprints, filename=None):
+        """
+        :param fingerprints: dict of model name -> fingerprint of the models queried
+        :param filename: database file, by default in the shared cache directory
+        """
+        self.fingerprints = fingerprints
+        self.filename = filename or cache_filename("neighbors", "neighbors.sqlite")
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS neighbors "
+                                "(word TEXT, model TEXT, fingerprint TEXT, neighbors TEXT, PRIMARY KEY (word, model))")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(neighbors)")]
+        if columns != COLUMNS:
+            self.connection.close()
+            raise ValueError("'%s' has a neighbors table with columns %s rather than %s: use another cache file" % (
+                self.filename, ", ".join(columns), ", ".join(COLUMNS)))
+
+    def get(self, models, word):
+        """
+        :param models: model names
+        :param word: query word
+        :return: list of results, like NearestNeighborsModels.read_nn_all, or None unless all models are cached with
+                 their current fingerprint
+        """
+        rows = {model: (fingerprint, neighbors) for model, fingerprint, neighbors in self.connection.execute(
+            "SELECT model, fingerprint, neighbors FROM neighbors WHERE word = ?", (word,))}
+        if not all(model in rows and rows[model][0] == self.fingerprints[model] for model in models):
+            return None
+        return [dict(model=model, nearestNeighbors=json.loads(rows[model][1])) for model in models]
+
+    def put(self, models, word, results):
+        """
+        :param models: model names, to record as having no neighbors for word unless they have a result
+        :param word: query word
+        :param results: list of results, as returned by NearestNeighborsModels.read_nn_all
+        """
+        neighbors = dict.fromkeys(models, [])
+        neighbors.update((result["model"], result["nearestNeighbors"]) for result in results)
+        self.connection.executemany("INSERT OR REPLACE INTO neighbors VALUES (?, ?, ?, ?)",
+                                    [(word, model, self.fingerprints[model], json.dumps(n))
+                                     for model, n in neighbors.items()])
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_nn_many(models, words, cache=None, workers=1):
+    """
+    Query nearest neighbors of many words in all models, running the queries not in the cache on a thread pool, with a
+    bounded number of them pending
+    :param models: NearestNeighborsModels
+    :param words: iterable of query words
+    :param cache: NeighborCache to look up results in and add new results to (optional)
+    :param workers: number of threads to run queries in; more than one requires models.read_nn_all to be thread-safe
+    :return: generator of (word, list of results), in order of words
+    """
+    model_names = list(models.models)
+    pending = deque()
+
+    def _pop():
+        word, results = pending.popleft()
+        if isinstance(results, Future):
+            results = results.result()
+            if cache:
+                cache.put(model_names, word, results)
+        return word, results
+
+    with ThreadPoolExecutor(workers) as executor:
+        for word in words:
+            results = cache.get(model_names, word) if cache else None
+            pending.append((word, executor.submit(models.read_nn_all, word) if results is None else results))
+            if len(pending) > QUEUE_SIZE * workers:
+                yield _pop()
+        while pending:
+            yield _pop()
@@ -1,31 +1,42 @@
 import json
 import os
 from argparse import ArgumentParser
+from contextlib import ExitStack
 
-import numpy as np
 from tqdm import tqdm
 
 from analytics.compress_relations_file import read_word_enums
+from analytics.neighbor_cache import NeighborCache, read_nn_many, model_fingerprints
+from analytics.similarity_store import SimilarityWriter, SparseSimilarityWriter, DTYPES
 from word_reps_tools.nearest_neighbors_models import NearestNeighborsModels
 
 
 def main(args):
     word_enums = read_word_enums(args.words)
     with open(args.configuration, encoding="utf-8") as f:
-        models = NearestNeighborsModels(json.load(f)['configuration'])
-    array = {model: np.zeros((len(word_enums[0]), len(word_enums[1])), dtype=float) for model in models.models}
-    for word1, i in tqdm(list(word_enums[0].items()), desc="Calculating similarities", unit=" words"):
-        for result in models.read_nn_all(word1):
-            model_array = array[result["model"]]
-            for word2, sim in result["nearestNeighbors"]:
-                j = word_enums[1].get(word2)
-                if j is not None:
-                    model_array[i, j] = sim
-    for model in models.models:
-        os.makedirs(args.out_dir, exist_ok=True)
-        array_file = os.path.join(args.out_dir, os.path.basename(model) + ".npz")
-        np.savez_compressed(array_file, sims=array[model])
-        print("Saved array to '%s'" % array_file)
+        configuration = json.load(f)['configuration']
+    models = NearestNeighborsModels(configuration)
+    os.makedirs(args.out_dir, exist_ok=True)
+    shape = tuple(map(len, word_enums))
+    with ExitStack() as stack:  # close all writers when done, or remove their files on error
+        cache = None if args.no_cache else stack.enter_context(
+            NeighborCache(model_fingerprints(configuration, models.models), args.cache))
+        writer_class, suffix = (SparseSimilarityWriter, ".npz") if args.sparse else (SimilarityWriter, ".npy")
+        writers = {model: stack.enter_context(writer_class(
+            os.path.join(args.out_dir, os.path.basename(model) + suffix), shape, dtype=args.dtype))
+            for model in models.models}
+        for word1, results in tqdm(read_nn_many(models, word_enums[0], cache, args.workers), total=len(word_enums[0]),
+                                   desc="Calculating similarities", unit=" words"):
+            i = word_enums[0][word1]
+            for result in results:
+                row = {}
+                for word2, sim in result["nearestNeighbors"]:
+                    j = word_enums[1].get(word2)
+                    if j is not None:
+                        row[j] = sim
+                writers[result["model"]].write_row(i, list(row), list(row.values()))
+    for writer in writers.values():
+        print("Saved array to '%s'" % writer.filename)
 
 
 if __name__ == "__main__":
@@ -33,5 +44,12 @@ if __name__ == "__main__":
                                            "lists")
     argparser.add_argument("words", nargs=2, help="Text files containing words to use for ordering")
     argparser.add_argument("configuration", help="JSON configuration for word representation models")
-    argparser.add_argument("-o", "--out-dir", default=".", help="Directory to save compressed matrix file to")
+    argparser.add_argument("-o", "--out-dir", default=".", help="Directory to save matrix files to")
+    argparser.add_argument("--dtype", choices=DTYPES, default="float32", help="Data type to store similarities as")
+    argparser.add_argument("--sparse", action="store_true", help="Store just the nearest neighbors, as a sparse matrix")
+    argparser.add_argument("-w", "--workers", type=int, default=1,
+                           help="Number of threads to query neighbors in (only if the models can be queried from "
+                                "several threads at once)")
+    argparser.add_argument("--cache", help="Neighbor cache database file (default: in the shared cache directory)")
+    argparser.add_argument("--no-cache", action="store_true", help="Do not read or write the neighbor cache")
     main(argparser.parse_args())
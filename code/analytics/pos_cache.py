@@ -0,0 +1,54 @@
+import json
+
+from tqdm import tqdm
+
+from evaluation.cache import cache_filename, atomic_write
+
+
+class PosCache:
+    """
+    Persistent lexicon of the part of speech and lemma spaCy assigns to single terms (by their first token), in a JSON
+    file per spaCy model name and version in the shared cache directory, so that each term is tagged once.
+    """
+    def __init__(self, nlp, cache_dir=None):
+        """
+        :param nlp: loaded spaCy model
+        :param cache_dir: cache directory to use instead of CACHE_DIR
+        """
+        self.nlp = nlp
+        self.filename = cache_filename("pos", "%s_%s-%s.json" % (nlp.meta["lang"], nlp.meta["name"],
+                                                                 nlp.meta["version"]), cache_dir)
+        self.lexicon = self.read()
+
+    def read(self):
+        try:
+            with open(self.filename, encoding="utf-8") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def tag(self, terms, desc="Tagging"):
+        """
+        Tag the terms not in the lexicon yet, in one batch, and save the lexicon if any were added
+        :param terms: iterable of terms
+        :param desc: progress bar description
+        """
+        new_terms = sorted(set(terms).difference(self.lexicon))
+        if not new_terms:
+            return
+        for term, doc in zip(new_terms, self.nlp.pipe(tqdm(new_terms, desc=desc, unit=" terms", leave=False))):
+            self.lexicon[term] = (doc[0].pos_, doc[0].lemma_) if len(doc) else ("", "")
+        lexicon = self.read()  # entries added by other processes meanwhile
+        lexicon.update(self.lexicon)
+        self.lexicon = lexicon
+        try:
+            with atomic_write(self.filename, "w", encoding="utf-8") as f:
+                json.dump(self.lexicon, f)
+        except OSError:  # read-only cache directory: keep the lexicon in memory only
+            pass
+
+    def pos(self, term):
+        return self.lexicon[term][0]
+
+    def lemma(self, term):
+        return self.lexicon[term][1]
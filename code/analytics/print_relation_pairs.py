@@ -1,15 +1,13 @@
 import os
 from argparse import ArgumentParser
 
-import numpy as np
-
-from analytics.compress_relations_file import read_word_enums, get_unique_relations
+from analytics.compress_relations_file import read_word_enums, get_unique_relations, RelationPairs
 
 
 def main(args):
     word_lists = list(map(list, read_word_enums(args.words)))
     print("Loading relations from '%s'" % args.relations)
-    relations = np.load(args.relations)["relations"]
+    relations = RelationPairs.load(args.relations)
     relation_enum = get_unique_relations(relation_titles=args.relation_titles, out_dir=args.out_dir)
     expected_dim = tuple(map(len, word_lists + [relation_enum]))
     assert relations.shape == expected_dim, "Relation matrix dim does not match word lists and relations: %s != %s" % (
@@ -29,7 +27,7 @@ def main(args):
 
     for relation, relation_index in relation_enum.items():
         _print(relation)
-        for i, j in zip(*(np.where(np.any(relations, axis=2 + relation_index))[:2])):
+        for i, j in zip(*relations.relation_pairs(relation_index)):
             _print(word_lists[0][i], word_lists[1][j])
         _print()
 
@@ -41,7 +39,7 @@ def main(args):
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Print all word pairs for each WordNet relation")
     argparser.add_argument("words", nargs=2, help="Text files containing words to use for ordering")
-    argparser.add_argument("relations", help=".npz file containing matrix of relations (from compress_relations_file)")
+    argparser.add_argument("relations", help=".npz file containing tensor of relations (from compress_relations_file)")
     argparser.add_argument("-r", "--relation-titles", help="Text file with one relation per file to use for the titles")
     argparser.add_argument("-o", "--out-dir", help="Directory to save pairs to")
     main(argparser.parse_args())
@@ -4,7 +4,8 @@ from argparse import ArgumentParser
 
 import numpy as np
 
-from cooccur.io import load_titles, load_counts
+from cooccur.io import load_titles
+from evaluation.sweep import load_counts
 from sib.joint_distribution import create_distribution
 from sib.partition import load_partition
 
@@ -4,9 +4,13 @@ from argparse import ArgumentParser
 from glob import glob
 
 import numpy as np
+from scipy import sparse
 from scipy.stats import hypergeom
 
-from analytics.compress_relations_file import get_unique_relations, read_word_enums
+from analytics.compress_relations_file import get_unique_relations, read_word_enums, RelationTensor
+from analytics.similarity_store import load_similarities
+
+BLOCK_ELEMENTS = 1 << 24  # number of similarities to read at once from a dense similarity matrix
 
 
 def gen_files(patterns):
@@ -19,81 +23,142 @@ def main(args):
 
     # Load relations
     print("Loading relations from '%s'" % args.relations)
-    relations = np.load(args.relations)["relations"]
+    relations = RelationTensor.load(args.relations)
     relation_list = list(get_unique_relations(relation_titles=args.relation_titles, out_dir=args.out_dir))
 
     # Calculate background distribution
     num_pairs = relations.shape[0] * relations.shape[1]
-    total_counts = relations.sum(axis=(0, 1))
+    total_counts = relations.totals()
+
+    # Cutoffs: the number of top pairs for each percentage
+    percents = sorted(set(args.percent))
+    num_tops = np.array([int(percent / 100 * num_pairs) for percent in percents])
 
-    # Create report if --out-dir is given
+    # Create report if --out-dir is given, with one pair of files per percentage
     if args.out_dir:
         os.makedirs(args.out_dir, exist_ok=True)
-        pvals_filename = os.path.join(args.out_dir, "pvals.csv")
-        pvals_f = open(pvals_filename, "w", encoding="utf-8", newline="")
-        pvals_writer = csv.writer(pvals_f)
-        counts_filename = os.path.join(args.out_dir, "counts.csv")
-        counts_f = open(counts_filename, "w", encoding="utf-8", newline="")
-        counts_writer = csv.writer(counts_f)
+        suffixes = ["_%g" % percent for percent in percents] if len(percents) > 1 else [""]
+        report_files = [open(os.path.join(args.out_dir, "%s%s.csv" % (name, suffix)), "w", encoding="utf-8",
+                             newline="") for suffix in suffixes for name in ("pvals", "counts")]
+        pvals_writers = list(map(csv.writer, report_files[::2]))
+        counts_writers = list(map(csv.writer, report_files[1::2]))
     else:
-        pvals_f = pvals_writer = counts_f = counts_writer = None
+        report_files = pvals_writers = counts_writers = None
 
     # Get model similarity matrices
     sim_files = sorted(gen_files(args.similarities))
     print("Loading similarity matrices from " + ", ".join(map("'{}'".format, sim_files)))
     sim_names = [os.path.splitext(os.path.basename(f))[0] for f in sim_files]
-    sim_names_len = max(map(len, sim_names))
+    labels = [["%s@%g%%" % (sim_name, percent) for percent in percents] if len(percents) > 1 else [sim_name]
+              for sim_name in sim_names]
+    sim_names_len = max(len(label) for sim_labels in labels for label in sim_labels)
     relation_titles_len = [max(17, len(r)) for r in relation_list]
-    num_top = int(args.percent / 100 * relations.shape[0] * relations.shape[1])
 
     # Print title
     title = ["%-*s" % (sim_names_len, "model")] + ["%-*s" % (l, p) for p, l in zip(relation_list, relation_titles_len)]
     counts_title = ["%-*s" % (sim_names_len, "total")] + \
                    ["%-*s" % (l, p) for p, l in zip(total_counts, relation_titles_len)]
     if args.out_dir:
-        pvals_writer.writerow(title)
-        counts_writer.writerow(title)
-        counts_writer.writerow(counts_title)
-    print("Total number of pairs: %d. Getting top %d%% by similarity (%d) for each model" % (
-        num_pairs, args.percent, num_top))
+        for writer in pvals_writers:
+            writer.writerow(title)
+        for writer in counts_writers:
+            writer.writerow(title)
+            writer.writerow(counts_title)
+    print("Total number of pairs: %d. Getting top %s by similarity (%s) for each model" % (
+        num_pairs, ", ".join("%g%%" % percent for percent in percents), ", ".join(map(str, num_tops))))
     print(*title)
     print(*counts_title)
 
     # Calculate p-values per model using hypergeometric test TODO also try t-test with actual pairs
-    for sim_file, sim_name in zip(sim_files, sim_names):
-        print("%-*s" % (sim_names_len, sim_name), end=" ", flush=True)
-        sims = np.load(sim_file)["sims"]
+    for sim_file, sim_name, sim_labels in zip(sim_files, sim_names, labels):
+        sims = load_similarities(sim_file)
         assert sims.shape == relations.shape[:2], "Similarity matrix shape must match relations matrix: %s != %s" % (
             sims.shape, relations.shape)
-        # Find indices of top X% pairs by similarity
-        top_indices = np.unravel_index(sims.ravel().argsort()[::-1][:num_top], sims.shape)
-        # noinspection PyTypeChecker
-        top_counts = relations[top_indices].sum(axis=0)
-        pvals = [hypergeom.sf(relation_top_count - 1, num_pairs, relation_total_count, num_top)
-                 for relation_top_count, relation_total_count in zip(top_counts, total_counts)]
-        print(*["%-*s" % (l, "%d (%.3g)" % (c, p)) for p, c, l in zip(pvals, top_counts, relation_titles_len)])
+        # Find indices of top X% pairs by similarity, for the largest X, sorting just them
+        if sparse.issparse(sims):  # Only stored pairs are neighbors, so there may be fewer of them than the cutoffs
+            sims = sims.tocoo()
+            sim_tops = np.minimum(num_tops, sims.nnz)
+            top = top_k(sims.data, sim_tops[-1])
+            top_indices = sims.row[top], sims.col[top]
+            top_sims = sims.data[top]
+        else:
+            sim_tops = num_tops
+            top_indices = np.unravel_index(top_k_blocks(sims, sim_tops[-1]), sims.shape)
+            top_sims = sims[top_indices]
+        # Count relations in the top pairs up to each cutoff: bin relations by the first cutoff including their pair
+        top_ranks, top_relations = relations.select(*top_indices)
+        bins = np.searchsorted(sim_tops, top_ranks, side="right")
+        top_counts = np.zeros((len(sim_tops), len(total_counts)), dtype=int)
+        np.add.at(top_counts, (bins, top_relations), 1)
+        top_counts = top_counts.cumsum(axis=0)
+        pvals = hypergeom.sf(top_counts - 1, num_pairs, total_counts, sim_tops[:, None])
+        for label, counts, percent_pvals in zip(sim_labels, top_counts, pvals):
+            print("%-*s" % (sim_names_len, label),
+                  *["%-*s" % (l, "%d (%.3g)" % (c, p)) for p, c, l in zip(percent_pvals, counts, relation_titles_len)])
         if args.out_dir:
-            pvals_writer.writerow([sim_name] + pvals)
-            counts_writer.writerow([sim_name] + list(top_counts))
-            if args.words:
-                with open(os.path.join(args.out_dir, "%s_pairs.csv" % sim_name), "w", encoding="utf-8", newline="") as f:
-                    csv.writer(f).writerows((word_lists[0][i], word_lists[1][j], sims[i, j], relation_list[r])
-                                            for i, j in zip(*top_indices) for r in range(len(relation_list))
-                                            if relations[i, j, r])
+            for pvals_writer, counts_writer, counts, percent_pvals in zip(pvals_writers, counts_writers, top_counts,
+                                                                          pvals):
+                pvals_writer.writerow([sim_name] + list(percent_pvals))
+                counts_writer.writerow([sim_name] + list(counts))
+            if args.words:  # Pairs in the top pairs for the largest percentage, by similarity rank and then relation
+                with open(os.path.join(args.out_dir, "%s_pairs.csv" % sim_name), "w", encoding="utf-8",
+                          newline="") as f:
+                    order = np.lexsort((top_relations, top_ranks))
+                    csv.writer(f).writerows((word_lists[0][i], word_lists[1][j], sim, relation_list[r])
+                                            for i, j, sim, r in zip(top_indices[0][top_ranks[order]],
+                                                                    top_indices[1][top_ranks[order]],
+                                                                    top_sims[top_ranks[order]], top_relations[order]))
     if args.out_dir:
-        pvals_f.close()
-        counts_f.close()
+        for f in report_files:
+            f.close()
+
+
+def top_k(x, k):
+    """
+    :param x: 1-dimensional array
+    :param k: number of elements to select
+    :return: indices of the k largest elements of x, sorted by decreasing value
+    """
+    if k < len(x):
+        x_top = np.argpartition(-x, k)[:k] if k else np.array([], dtype=int)
+    else:
+        x_top = np.arange(len(x))
+    return x_top[np.argsort(-x[x_top], kind="stable")]
+
+
+def top_k_blocks(sims, k, block_elements=BLOCK_ELEMENTS):
+    """
+    Like top_k of sims.ravel(), but reading a block of rows at a time, so that a memory-mapped matrix is never loaded
+    or copied whole: the top k of each block are merged with the top k so far, keeping at most 2k candidates
+    :param sims: 2-dimensional array
+    :param k: number of elements to select
+    :param block_elements: number of elements to read at once
+    :return: flat indices of the k largest elements of sims, sorted by decreasing value and then by index
+    """
+    num_columns = max(1, sims.shape[1])
+    block_rows = max(1, block_elements // num_columns)
+    indices, values = np.array([], dtype=np.int64), np.array([], dtype=sims.dtype)
+    for start in range(0, sims.shape[0] if k else 0, block_rows):
+        block = np.asarray(sims[start:start + block_rows]).ravel()
+        block_top = np.argpartition(-block, k)[:k] if k < len(block) else np.arange(len(block))
+        indices = np.concatenate((indices, block_top + start * num_columns))
+        values = np.concatenate((values, block[block_top]))
+        if len(values) > k:
+            keep = np.argpartition(-values, k)[:k]
+            indices, values = indices[keep], values[keep]
+    return indices[np.lexsort((indices, -values))]
 
 
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Calculate enrichment of various semantic relations from WordNet in"
                                            "nearest neighbor lists of words")
-    argparser.add_argument("relations", help=".npz file containing matrix of relations (from compress_relations_file)")
-    argparser.add_argument("similarities", nargs="+", help=".npz files containing model sims (from pair_similarities)")
+    argparser.add_argument("relations", help=".npz file containing tensor of relations (from compress_relations_file)")
+    argparser.add_argument("similarities", nargs="+",
+                           help=".npy/.npz files containing model sims (from pair_similarities)")
     argparser.add_argument("-r", "--relation-titles", help="Text file with one relation per file to use for the titles")
     argparser.add_argument("-w", "--words", nargs=2, help="Text files containing words to use for ordering")
-    argparser.add_argument("-p", "--percent", type=float, default=10, help="Percentage ratio of NNs for foreground dist"
-                                                                           " (default: 10)")
+    argparser.add_argument("-p", "--percent", type=float, nargs="+", default=[10],
+                           help="Percentage ratios of NNs for foreground dist, each making a cutoff (default: 10)")
     argparser.add_argument("-m", "--model", default="all", help="Word representation model to focus on")
     argparser.add_argument("-o", "--out-dir", help="Directory to save report to")
     main(argparser.parse_args())
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+from evaluation.cache import atomic_write
+
+DTYPES = ("float16", "float32", "float64")
+BLOCK_SIZE = 1024  # number of rows to write between flushes
+
+
+class SimilarityWriter:
+    """
+    Write a similarity matrix to a .npy file row by row, through a memory map flushed every block of rows, so that
+    only about one block of it is held in memory. The file is moved into place when closed.
+    """
+    def __init__(self, filename, shape, dtype="float32", block_size=BLOCK_SIZE):
+        self.filename = filename
+        self.tmp = "%s.%d.tmp" % (filename, os.getpid())
+        self.sims = np.lib.format.open_memmap(self.tmp, mode="w+", dtype=dtype, shape=shape)
+        self.block_size = block_size
+        self.rows = 0
+
+    def write_row(self, i, j, sims):
+        """
+        :param i: row index
+        :param j: array of column indices
+        :param sims: array of similarities for the columns, the rest of the row remaining zero
+        """
+        self.sims[i, j] = sims
+        self.rows += 1
+        if self.rows % self.block_size == 0:
+            self.sims.flush()
+
+    def close(self):
+        self.sims.flush()
+        del self.sims
+        os.replace(self.tmp, self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            del self.sims
+            os.remove(self.tmp)
+
+
+class SparseSimilarityWriter:
+    """
+    Write a similarity matrix with few nonzero entries per row (e.g., nearest neighbors) to a sparse CSR .npz file,
+    keeping only the nonzero entries in memory. Has the same interface as SimilarityWriter.
+    """
+    def __init__(self, filename, shape, dtype="float32"):
+        self.filename = filename
+        self.shape = shape
+        self.dtype = dtype
+        self.rows, self.cols, self.data = [], [], []
+
+    def write_row(self, i, j, sims):
+        self.rows.append(np.full(len(j), i, dtype=np.int32))
+        self.cols.append(np.asarray(j, dtype=np.int32))
+        self.data.append(np.asarray(sims, dtype=self.dtype))
+
+    def close(self):
+        rows, cols, data = (np.concatenate(a) if a else np.array([], dtype=d) for a, d in (
+            (self.rows, np.int32), (self.cols, np.int32), (self.data, self.dtype)))
+        sims = sparse.csr_matrix((data, (rows, cols)), shape=self.shape)
+        sims.eliminate_zeros()
+        with atomic_write(self.filename) as f:
+            sparse.save_npz(f, sims)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+def load_similarities(filename):
+    """
+    :param filename: .npy file written by SimilarityWriter, .npz file written by SparseSimilarityWriter,
+                     or .npz file with "sims" (older pair_similarities)
+    :return: similarity matrix, memory-mapped read-only if in a .npy file, or CSR matrix if sparse
+    """
+    if filename.endswith(".npz"):
+        with np.load(filename) as f:
+            if "sims" in f:
+                return f["sims"]
+        return sparse.load_npz(filename).tocsr()
+    return np.load(filename, mmap_mode="r")
@@ -4,21 +4,24 @@ from collections import Counter
 from itertools import chain
 from pprint import pprint
 
+from analytics.wn_index import load_index
 from analytics.wn_relations import find_relations, all_relations
 
 
-def relation_hist(pairs):
-    return dict(Counter(chain(*map(find_relations, pairs))))
+def relation_hist(pairs, index=None):
+    return dict(Counter(chain(*(find_relations(pair, index=index) for pair in pairs))))
 
 
 def main(args):
     with open(args.pairs, encoding="utf-8") as f:
         pairs = list(csv.reader(f))
-    pprint(all_relations(pairs) if args.show_all else relation_hist(pairs))
+    index = load_index(args.wn_index)
+    pprint(all_relations(pairs, index) if args.show_all else relation_hist(pairs, index))
 
 
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Calculate enrichment of various semantic relations from WordNet in pairs")
     argparser.add_argument("pairs", help="CSV file containing word pairs to look up")
     argparser.add_argument("-a", "--show-all", action="store_true", help="Show all pairs in each relation")
+    argparser.add_argument("--wn-index", help="Directory of WordNet index built by analytics.wn_index, to use if given")
     main(argparser.parse_args())
@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import sys
+from argparse import ArgumentParser
+from array import array
+
+import numpy as np
+from nltk.corpus import wordnet as wn
+from tqdm import tqdm
+
+from analytics.wn_relations import gen_related, ALL_RELATIONS
+
+META_FILE = "meta.json"
+KEYS_FILE = "keys.txt"
+LEMMAS_FILE = "lemmas.tsv"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.npy"
+CHECK_SAMPLE = 1000  # number of words to compare against NLTK after building
+
+
+class WordNetIndex:
+    """
+    Precomputed output of gen_related for every lemma name in WordNet, as built by main.
+    For key k (a lowercase lemma name) and relation r (an index into ALL_RELATIONS), the IDs of the related lemmas,
+    each a distinct (name, part of speech) pair, are ids[offsets[k * len(ALL_RELATIONS) + r]:offsets[... + 1]].
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["relations"] != list(ALL_RELATIONS):
+            raise ValueError("WordNet index in '%s' has different relations, rebuild it" % directory)
+        if meta["wordnet"] != wn.get_version():
+            print("Warning: WordNet index in '%s' was built from WordNet %s, but %s is installed" % (
+                directory, meta["wordnet"], wn.get_version()), file=sys.stderr)
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(directory, IDS_FILE), mmap_mode="r")
+        with open(os.path.join(directory, KEYS_FILE), encoding="utf-8") as f:
+            self.keys = {key: i for i, key in enumerate(line.rstrip("\n") for line in f)}
+        with open(os.path.join(directory, LEMMAS_FILE), encoding="utf-8") as f:
+            lemmas = [line.rstrip("\n").split("\t") for line in f]
+        self.names = [name for name, _ in lemmas]
+        self.pos = [pos for _, pos in lemmas]
+        self.lower_names = [name.lower() for name in self.names]
+
+    def related(self, word, relations=None):
+        """
+        Like gen_related, but with lemma IDs instead of lemmas
+        :param word: word to find related lemmas for
+        :param relations: relations to include (all if not given)
+        :return: list of (relation, array of lemma IDs), or None if the word is not in the index
+        """
+        key = self.keys.get(word.lower())
+        if key is None:
+            return None
+        start = key * len(ALL_RELATIONS)
+        return [(relation, self.ids[self.offsets[start + i]:self.offsets[start + i + 1]])
+                for i, relation in enumerate(ALL_RELATIONS) if not relations or relation in relations]
+
+
+def load_index(directory):
+    """:return: WordNetIndex from directory, or None if not given"""
+    if not directory:
+        return None
+    print("Loading WordNet index from '%s'..." % directory)
+    return WordNetIndex(directory)
+
+
+def check_index(index, words):
+    """
+    Compare the index output with gen_related for the given words
+    :param index: WordNetIndex
+    :param words: lowercase lemma names to check
+    :return: list of (word, relation) pairs for which the related lemmas differ
+    """
+    mismatches = []
+    for word in tqdm(words, desc="Checking WordNet index", unit=" words", file=sys.stdout):
+        expected = {relation: {(lemma.name(), lemma.synset().pos()) for lemma in lemmas}
+                    for relation, lemmas in gen_related(word)}
+        for relation, ids in index.related(word):
+            if {(index.names[i], index.pos[i]) for i in ids} != expected[relation]:
+                mismatches.append((word, relation))
+    return mismatches
+
+
+def main(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    keys = sorted(set(wn.all_lemma_names()))
+    lemma_ids = {}
+    offsets = array("q", [0])
+    ids = array("i")
+    for key in tqdm(keys, desc="Indexing WordNet relations", unit=" words", file=sys.stdout):
+        relations = []
+        for relation, lemmas in gen_related(key):  # consume each relation before the next: some are lazy
+            relations.append(relation)
+            ids.extend(sorted({lemma_ids.setdefault((lemma.name(), lemma.synset().pos()), len(lemma_ids))
+                               for lemma in lemmas}))
+            offsets.append(len(ids))
+        assert relations == list(ALL_RELATIONS), key
+    np.save(os.path.join(args.out_dir, OFFSETS_FILE), np.frombuffer(offsets, dtype=np.int64))
+    np.save(os.path.join(args.out_dir, IDS_FILE), np.frombuffer(ids, dtype=np.int32))
+    with open(os.path.join(args.out_dir, KEYS_FILE), "w", encoding="utf-8") as f:
+        f.writelines(key + "\n" for key in keys)
+    with open(os.path.join(args.out_dir, LEMMAS_FILE), "w", encoding="utf-8") as f:
+        f.writelines("%s\t%s\n" % lemma for lemma in lemma_ids)
+    with open(os.path.join(args.out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(dict(relations=ALL_RELATIONS, wordnet=wn.get_version()), f, indent=1)
+    print("Indexed %d words and %d lemmas in '%s'" % (len(keys), len(lemma_ids), args.out_dir))
+    if args.check:
+        mismatches = check_index(WordNetIndex(args.out_dir),
+                                 random.Random(0).sample(keys, min(args.check, len(keys))))
+        if mismatches:
+            raise ValueError("WordNet index in '%s' differs from NLTK for %d relations, e.g. %s" % (
+                args.out_dir, len(mismatches), ", ".join("%s/%s" % m for m in mismatches[:10])))
+
+
+if __name__ == "__main__":
+    argparser = ArgumentParser(description="Precompute WordNet relations of all lemma names, for fast lookup")
+    argparser.add_argument("-o", "--out-dir", default="wn_index", help="Directory to save the index to")
+    argparser.add_argument("--check", type=int, default=CHECK_SAMPLE,
+                           help="Number of random words to compare against NLTK after building (0 to skip)")
+    main(argparser.parse_args())
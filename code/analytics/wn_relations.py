@@ -1,15 +1,15 @@
 import csv
 import os
+import shutil
 from argparse import ArgumentParser
 from bisect import bisect
-from functools import reduce
-from itertools import product, chain, permutations
-from operator import mul
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product, permutations
 
 from nltk.corpus import wordnet as wn
 from tqdm import tqdm
 
-from util.lazylist import List
+from analytics.checkpoint import Checkpoint
 
 IDENTITY = "identity"
 SYNONYMS = "synonyms"
@@ -23,6 +23,9 @@ INDIRECT_PREFIX = "indirect_"
 CO_PREFIX = "co_"
 DIRECT_RELATIONS = (SYNONYMS,) + SYNSET_RELATIONS + OTHER_SYNSET_RELATIONS + LEMMA_RELATIONS
 UNIQUE_RELATIONS = ("identity", "synonyms")
+ALL_RELATIONS = (IDENTITY, SYNONYMS) + SYNSET_RELATIONS + OTHER_SYNSET_RELATIONS + \
+                tuple(INDIRECT_PREFIX + r for r in SYNSET_RELATIONS) + LEMMA_RELATIONS + \
+                tuple(CO_PREFIX + r for r in SYNSET_RELATIONS[::2])  # in the order gen_related yields them
 
 DEPTH = 20
 
@@ -60,16 +63,65 @@ def gen_related(word, relations=None):
             yield CO_PREFIX + relation, (lemma for synset2 in related_synsets_co for lemma in synset2.lemmas())
 
 
-def find_relations(words, by_pair=False):
+def gen_related_keys(word, index=None):
+    """
+    Like gen_related, but with keys identifying the related lemmas, to match against candidate_keys
+    :param word: pivot word
+    :param index: WordNetIndex to look up the pivot in, falling back to NLTK if it is not there
+    :return: generator of (relation, iterable of keys)
+    """
+    related = index.related(word) if index else None
+    if related is not None:
+        return ((relation, (index.lower_names[i] for i in ids)) for relation, ids in related)
+    if index:
+        return ((relation, (lemma.name().lower() for lemma in lemmas)) for relation, lemmas in gen_related(word))
+    return gen_related(word)
+
+
+def candidate_keys(word, index=None):
+    """
+    Keys of the lemmas of a candidate word: the lemmas themselves, or with an index, their lowercase name.
+    The lemmas of a word are exactly the lemmas named like it, ignoring case, in its synsets (which include them all).
+    """
+    return {word.lower()} if index else wn.lemmas(word)
+
+
+class CandidateIndex:
+    """Inverted index from lemma keys to the positions of the candidate words having them, built once per list"""
+    def __init__(self, candidates, index=None):
+        self.candidates = candidates
+        self.positions = {}
+        for i, candidate in enumerate(candidates):
+            for key in candidate_keys(candidate, index):
+                self.positions.setdefault(key, []).append(i)
+
+
+def find_relations(words, by_pair=False, index=None):
     pivot, *candidates = words
-    candidate_lemmas = [set(wn.lemmas(w)) for w in candidates]
+    return find_candidate_relations(pivot, CandidateIndex(candidates, index), by_pair=by_pair, index=index)
+
+
+def find_candidate_relations(pivot, candidate_index, start=0, by_pair=False, index=None):
+    """
+    Find the relations between a pivot word and each candidate word
+    :param pivot: word to find related words for
+    :param candidate_index: CandidateIndex of the candidate words
+    :param start: position of the first candidate to consider
+    :param by_pair: return dict of pair -> relations rather than of relation -> pairs, with all pairs if "all"
+    :param index: WordNetIndex to look up the pivot in (optional)
+    """
+    candidates = candidate_index.candidates[start:]
     relations = {}
-    for relation, related in gen_related(pivot):
-        related_lemmas = List(related)
-        for candidate, lemmas in zip(candidates, candidate_lemmas):
-            if (pivot, candidate) not in chain(*(relations.get(r, ()) for r in UNIQUE_RELATIONS)) and \
-                    any(lemma in lemmas for lemma in related_lemmas):
-                relations.setdefault(relation, []).append((pivot, candidate))
+    claimed = set()  # positions of candidates already found in one of UNIQUE_RELATIONS
+    for relation, related in gen_related_keys(pivot, index):
+        found = set()
+        for key in related:
+            found.update(candidate_index.positions.get(key, ()))
+        found = sorted(i for i in found - claimed if i >= start)
+        if found:
+            relations[relation] = [(pivot, candidate_index.candidates[i]) for i in found]
+            if relation in UNIQUE_RELATIONS:
+                claimed.update(found)
     if by_pair:
         pair_relations = {(pivot, c): [] for c in candidates} if by_pair == "all" else {}
         for relation, pairs in relations.items():
@@ -80,10 +132,10 @@ def find_relations(words, by_pair=False):
         return relations
 
 
-def all_relations(lists):
+def all_relations(lists, index=None):
     relation_pairs = {}
     for words in lists:
-        for relation, pairs in find_relations(words).items():
+        for relation, pairs in find_relations(words, index=index).items():
             relation_pairs.setdefault(relation, []).extend(pairs)
     return relation_pairs
 
@@ -96,25 +148,112 @@ def read_word_lists(filenames):
     return word_lists
 
 
+_shared = {}  # per-process state for finding shard relations: word lists, WordNet index and candidate indices
+
+
+def init_shared(word_lists, wn_index=None):
+    """
+    Set the state shared by find_shard_relations calls in this process
+    :param word_lists: sorted word lists
+    :param wn_index: directory of WordNet index (optional)
+    """
+    from analytics.wn_index import WordNetIndex  # imports this module
+    _shared.update(word_lists=word_lists, word_sets=list(map(set, word_lists)),
+                   list_pairs=list(permutations(range(len(word_lists)), 2)),
+                   index=WordNetIndex(wn_index) if wn_index else None, candidate_indices={})
+
+
+def get_candidate_index(j, excluded):
+    """
+    :param j: index of the word list to take candidates from
+    :param excluded: indices of word lists whose words to leave out
+    :return: CandidateIndex, created once per process
+    """
+    key = (j, excluded)
+    candidate_index = _shared["candidate_indices"].get(key)
+    if candidate_index is None:
+        candidates = [w for w in _shared["word_lists"][j] if not any(w in _shared["word_sets"][b] for b in excluded)]
+        candidate_index = _shared["candidate_indices"][key] = CandidateIndex(candidates, _shared["index"])
+    return candidate_index
+
+
+def get_shards(word_lists, shard_size):
+    """:return: list of (list pair index, start, stop) covering the pivots of each permutation of the word lists"""
+    return [(p, start, min(start + shard_size, len(word_lists[i])))
+            for p, (i, _) in enumerate(permutations(range(len(word_lists)), 2))
+            for start in range(0, len(word_lists[i]), shard_size)]
+
+
+def find_shard_relations(shard, filename):
+    """
+    Find relations of a slice of the pivots in one permutation of the word lists, pairing each pivot with the candidates
+    following it, and write those with any relation to a CSV file.
+    Pairs found already in an earlier permutation (pivot in its first list, candidate in its second) are skipped.
+    :param shard: (list pair index, start, stop)
+    :param filename: CSV file to write to
+    :return: (filename, number of pivots, number of pairs found)
+    """
+    p, first, last = shard
+    list_pairs, word_sets = _shared["list_pairs"], _shared["word_sets"]
+    i, j = list_pairs[p]
+    pivots = _shared["word_lists"][i][first:last]
+    found = 0
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        for w in pivots:
+            candidate_index = get_candidate_index(j, tuple(sorted({b for a, b in list_pairs[:p] if w in word_sets[a]})))
+            start = bisect(candidate_index.candidates, w)
+            for pair, relations in find_candidate_relations(w, candidate_index, start=start, by_pair="all",
+                                                            index=_shared["index"]).items():
+                if relations:
+                    found += 1
+                    writer.writerow(pair + tuple(relations))
+    return filename, len(pivots), found
+
+
 def main(args):
     word_lists = list(map(sorted, read_word_lists(args.words)))
     os.makedirs(args.out_dir, exist_ok=True)
     relations_file = os.path.join(args.out_dir, "relations.csv")
-    t = tqdm((item for l1, l2 in permutations(word_lists, 2) for w in l1
-              for item in find_relations([w] + l2[bisect(l2, w):], by_pair="all").items()),
-             desc="Finding relations", unit=" pairs", total=reduce(mul, map(len, word_lists), 1))
+    shard_dir = os.path.join(args.out_dir, "relations_shards")
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = get_shards(word_lists, args.shard_size)
+    filenames = [os.path.join(shard_dir, "%d.csv" % n) for n in range(len(shards))]
+    checkpoint = Checkpoint(relations_file, list(map("\t".join, word_lists)) + ["--shard-size", str(args.shard_size)])
+    t = tqdm(desc="Finding relations", unit=" pivots", total=(len(word_lists) - 1) * sum(map(len, word_lists)))
     found = 0
-    with open(relations_file, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f)
-        for pair, relations in t:
-            t.set_postfix(found=found, pair=pair)
-            if relations:
-                found += 1
-                writer.writerow(pair + tuple(relations))
+    with checkpoint.open(args.resume) as f:
+        def _merge(results):  # append shard files in order, as soon as each one and all before it are done
+            nonlocal found
+            for shard, (filename, num_pivots, num_found) in zip(shards[checkpoint.done:], results):
+                with open(filename, encoding="utf-8", newline="") as shard_f:
+                    shutil.copyfileobj(shard_f, f)
+                os.remove(filename)
+                found += num_found
+                t.update(num_pivots)
+                t.set_postfix(found=found)
+                checkpoint.update(f, shard)
+        t.update(sum(last - first for _, first, last in shards[:checkpoint.done]))
+        todo = shards[checkpoint.done:], filenames[checkpoint.done:]
+        if args.workers == 1:
+            init_shared(word_lists, args.wn_index)
+            _merge(map(find_shard_relations, *todo))
+        else:
+            with ProcessPoolExecutor(args.workers, initializer=init_shared,
+                                     initargs=(word_lists, args.wn_index)) as executor:
+                _merge(executor.map(find_shard_relations, *todo))
+    t.close()
+    checkpoint.remove()
+    os.rmdir(shard_dir)
+    print("Found %d related pairs, saved to '%s'" % (found, relations_file))
 
 
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Find relations for all pairs in cartesian product of two lists")
     argparser.add_argument("words", nargs=2, help="Text files containing words to make pairs out of")
     argparser.add_argument("-o", "--out-dir", default=".", help="Directory to save counts to")
+    argparser.add_argument("--wn-index", help="Directory of WordNet index built by analytics.wn_index, to use if given")
+    argparser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes to find relations in")
+    argparser.add_argument("--shard-size", type=int, default=100, help="Number of pivot words per shard")
+    argparser.add_argument("--resume", action="store_true", help="Continue from the checkpoint of an interrupted run")
     main(argparser.parse_args())
@@ -3,7 +3,9 @@ from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
-from scipy.stats import spearmanr
+from scipy.stats import rankdata, spearmanr
+
+from evaluation.cache import cache_filename, atomic_write, strings_digest
 
 CONCEPT_COLUMNS = ["concept 1", "concept 2"]
 WORD_COLUMNS = ["word 1", "word 2"]
@@ -27,6 +29,16 @@ def spearman(x, y):
     return spearmanr(x, y)[0]
 
 
+def spearman_columns(x, y):
+    """Spearman correlation of each column of x with y, ranking all columns at once"""
+    x_ranks = rankdata(x, axis=0)
+    y_ranks = rankdata(y)
+    x_ranks -= x_ranks.mean(axis=0)
+    y_ranks -= y_ranks.mean()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return y_ranks.dot(x_ranks) / (np.linalg.norm(x_ranks, axis=0) * np.linalg.norm(y_ranks))
+
+
 CORR_METHODS = OrderedDict((("pearson", pearson), ("spearman", spearman)))
 
 
@@ -42,8 +54,23 @@ def extract_all_concepts(df):
     return set(pd.concat(map(df.get, CONCEPT_COLUMNS)))
 
 
+def concept_ids(df, enum):
+    """
+    Map all benchmark concept pairs to IDs in one pass
+    :param df: benchmark DataFrame containing CONCEPT_COLUMNS
+    :param enum: dict of concept -> ID
+    :return: boolean array marking pairs with both concepts found, and two arrays of IDs for the found pairs
+    """
+    ids = np.column_stack([df[column].map(enum).values.astype(float) for column in CONCEPT_COLUMNS])
+    found = ~np.isnan(ids).any(axis=1)
+    x1, x2 = ids[found].astype(int).T
+    return found, x1, x2
+
+
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
+_loaded = {}  # (benchmark name, parse parameters) -> DataFrame, so that each benchmark is parsed at most once
+
 
 class Benchmark:
     def __init__(self, name, path, sep=",", score_column=-1, header=False):
@@ -54,10 +81,60 @@ class Benchmark:
         self.header = header
 
     def load(self, verbose=True):
-        filename = self.get_filename()
         if verbose:
-            print("Loading benchmark data from '%s'..." % filename)
-        return self.extract_columns(pd.read_csv(filename, sep=self.sep, skiprows=1 if self.header else 0, header=None))
+            print("Loading benchmark data from '%s'..." % self.get_filename())
+        key = (self.name, self.params_digest())
+        df = _loaded.get(key)
+        if df is None:
+            df = _loaded[key] = self.load_compiled()
+        return df.copy()
+
+    def parse(self):
+        return self.extract_columns(pd.read_csv(self.get_filename(), sep=self.sep, skiprows=1 if self.header else 0,
+                                                header=None))
+
+    def parse_params(self):
+        """:return: list of strings with the parameters parse depends on, besides the file contents"""
+        return [self.path, self.sep, str(self.score_column), str(self.header)]
+
+    def params_digest(self):
+        return strings_digest(self.parse_params())
+
+    def load_compiled(self):
+        """
+        Load benchmark from its compiled form (word columns and float32 scores) in the cache directory.
+        If missing, or the source file (by mtime and size) or the parse parameters changed, parse the source file and
+        compile it.
+        :return: DataFrame with WORD_COLUMNS and "score"
+        """
+        stat = os.stat(self.get_filename())
+        params = self.params_digest()
+        compiled = cache_filename("benchmarks", self.name + ".npz")
+        try:
+            with np.load(compiled) as f:
+                if f["mtime"] == stat.st_mtime_ns and f["size"] == stat.st_size and f["params"] == params:
+                    return self.from_arrays(f)
+        except (IOError, KeyError, ValueError):
+            pass
+        df = self.parse()
+        arrays = dict(mtime=stat.st_mtime_ns, size=stat.st_size, params=params,
+                      score=df["score"].values.astype(np.float32))
+        for i, column in enumerate(WORD_COLUMNS):
+            arrays["missing%d" % i] = df[column].isna().values
+            arrays["words%d" % i] = df[column].where(df[column].notna(), "").values.astype(str)
+        try:
+            with atomic_write(compiled) as f:
+                np.savez(f, **arrays)
+        except OSError:  # read-only cache directory: just use the parsed data
+            pass
+        return self.from_arrays(arrays)
+
+    @staticmethod
+    def from_arrays(arrays):
+        df = pd.DataFrame({column: np.where(arrays["missing%d" % i], np.nan, arrays["words%d" % i].astype(object))
+                           for i, column in enumerate(WORD_COLUMNS)})
+        df["score"] = arrays["score"]
+        return df
 
     def extract_columns(self, df):
         df = df.iloc[:, [0, 1, self.score_column]]
@@ -73,8 +150,11 @@ class ConceptBenchmark(Benchmark):
         super().__init__(name, path)
         self.term_titles = term_titles
 
-    def load(self, verbose=True):
-        return self.extract_columns(load_benchmark(self.get_filename(), verbose=verbose)[self.term_titles + ["score"]])
+    def parse(self):
+        return self.extract_columns(load_benchmark(self.get_filename(), verbose=False)[self.term_titles + ["score"]])
+
+    def parse_params(self):
+        return [self.path] + self.term_titles
 
 
 WORD_BENCHMARKS = (
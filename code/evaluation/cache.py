@@ -0,0 +1,57 @@
+import hashlib
+import os
+from contextlib import contextmanager
+
+CACHE_DIR = os.environ.get("INTERCHANGEABILITY_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "interchangeability"))
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """SHA-1 hex digest of the contents of a file"""
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def strings_digest(strings):
+    """SHA-1 hex digest of a sequence of strings"""
+    h = hashlib.sha1()
+    for s in strings:
+        h.update(s.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def cache_filename(subdir, name, cache_dir=None):
+    """
+    Get the path of a cache file. Its directory is not created here but by atomic_write, so that reading from a cache
+    directory that cannot be created just fails like a cache miss.
+    :param subdir: subdirectory of the cache directory, per cache type
+    :param name: file name within subdir
+    :param cache_dir: cache directory to use instead of CACHE_DIR
+    :return: full path
+    """
+    return os.path.join(cache_dir or CACHE_DIR, subdir, name)
+
+
+@contextmanager
+def atomic_write(filename, mode="wb", **kwargs):
+    """
+    Open a temporary file for writing and move it to filename when done, so readers never see a partial file.
+    The directory of filename is created if necessary.
+    :param filename: final file name
+    :param mode: file mode, "wb" or "w"
+    :param kwargs: passed to open
+    :return: file object
+    """
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    tmp = "%s.%d.tmp" % (filename, os.getpid())
+    try:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
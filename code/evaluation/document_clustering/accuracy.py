@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import sparse
 
 
 def accuracy(T, labels):
@@ -9,6 +10,8 @@ def accuracy(T, labels):
     :param labels: one-hot matrix of correct labels for each x
     :return accuracy
     """
-    counts = [labels[T.pt_x == t].sum(axis=0) for t in range(T.size)]
-    majority = np.argmax(counts, axis=-1).squeeze()
-    return np.mean(majority[T.pt_x] == labels.nonzero()[1])
+    label_x = labels.nonzero()[1]
+    contingency = sparse.coo_matrix((np.ones(len(label_x)), (T.pt_x, label_x)),
+                                    shape=(T.size, labels.shape[1])).tocsr()  # cluster x label counts
+    majority = contingency.toarray().argmax(axis=1)
+    return np.mean(majority[T.pt_x] == label_x)
@@ -1,4 +1,7 @@
 import math
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 from evaluation.document_clustering.accuracy import accuracy
 from sib.sequential_document_clustering import get_datasets, load_dataset
@@ -7,23 +10,32 @@ from sib.sequential_information_bottleneck import sIB
 RESTARTS = 5
 SEEDS = 5
 
+load_dataset_cached = lru_cache(maxsize=1)(load_dataset)  # per worker; each chunk of tasks is of one dataset
 
-def main():
-    accs = []
-    for dataset in get_datasets("all"):
-        print("Using dataset '%s'" % dataset)
-        m, labels = load_dataset(dataset)
-        dataset_accs = []
-        for _ in range(SEEDS):
-            logs, T, prm = sIB(m, t_size=labels.shape[1], beta=math.inf, centroid_figures=False, restarts=RESTARTS,
-                               uniform_prior=False, calc_i=False, loop_limit=100, seed=None)
-            acc = accuracy(T, labels)
-            print("accuracy = %.3f" % acc)
-            dataset_accs.append(acc)
-        accs.append((dataset, sum(dataset_accs) / SEEDS))
+
+def evaluate(dataset, seed):
+    m, labels = load_dataset_cached(dataset)
+    logs, T, prm = sIB(m, t_size=labels.shape[1], beta=math.inf, centroid_figures=False, restarts=RESTARTS,
+                       uniform_prior=False, calc_i=False, loop_limit=100, seed=seed)
+    return accuracy(T, labels)
+
+
+def main(args):
+    datasets = list(get_datasets("all"))
+    tasks = [(dataset, args.seed + i) for dataset in datasets for i in range(SEEDS)]
+    dataset_accs = {}
+    with ProcessPoolExecutor(args.jobs) as executor:
+        # tasks are ordered by dataset, SEEDS per dataset, so each chunk of SEEDS tasks is one whole dataset
+        for (dataset, seed), acc in zip(tasks, executor.map(evaluate, *zip(*tasks), chunksize=SEEDS)):
+            print("%s (seed %d): accuracy = %.3f" % (dataset, seed, acc))
+            dataset_accs.setdefault(dataset, []).append(acc)
+    accs = [(dataset, sum(dataset_accs[dataset]) / SEEDS) for dataset in datasets]
     if len(accs) > 1:
         print("\nsummary:\n" + "\n".join("%s: %.3f" % x for x in accs))
 
 
 if __name__ == "__main__":
-    main()
+    argparser = ArgumentParser(description="Evaluate sIB document clustering accuracy on all datasets")
+    argparser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes")
+    argparser.add_argument("-s", "--seed", type=int, default=0, help="Base random seed; seeds are seed, seed+1, ...")
+    main(argparser.parse_args())
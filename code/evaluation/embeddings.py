@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+from evaluation.cache import atomic_write, strings_digest
+
+MATRIX_SUFFIX = ".npy"
+WORDS_SUFFIX = ".words.txt"
+SOURCE_SUFFIX = ".source.json"
+
+
+def read_word(f):
+    """Read one space-terminated word from a word2vec binary file, skipping the newline ending the previous row"""
+    chars = []
+    while True:
+        c = f.read(1)
+        if c == b" " or not c:
+            return b"".join(chars).decode("utf-8", errors="replace")
+        if c != b"\n":
+            chars.append(c)
+
+
+def convert_w2v(filename, prefix):
+    """
+    Convert a word2vec binary file, in one streaming pass, to a matrix that can be memory-mapped and a word list.
+    fastText .bin models have a different format, and should be saved as word2vec binary first.
+    :param filename: word2vec binary file
+    :param prefix: output path prefix, to write prefix + MATRIX_SUFFIX and prefix + WORDS_SUFFIX
+    """
+    with open(filename, "rb") as f:
+        num_words, dim = map(int, f.readline().split())
+        matrix_tmp, words_tmp = prefix + MATRIX_SUFFIX + ".tmp", prefix + WORDS_SUFFIX + ".tmp"
+        vectors = np.lib.format.open_memmap(matrix_tmp, mode="w+", dtype=np.float32, shape=(num_words, dim))
+        with open(words_tmp, "w", encoding="utf-8") as words_f:
+            for i in tqdm(range(num_words), desc="Converting '%s'" % filename, unit=" words", file=sys.stdout):
+                print(read_word(f), file=words_f)
+                vectors[i] = np.frombuffer(f.read(4 * dim), dtype="<f4")
+        vectors.flush()
+        del vectors
+    os.replace(words_tmp, prefix + WORDS_SUFFIX)
+    os.replace(matrix_tmp, prefix + MATRIX_SUFFIX)
+
+
+def source_digest(filename):
+    """Digest of the absolute path, size and mtime of a file, identifying the version converted from it"""
+    stat = os.stat(filename)
+    return strings_digest([os.path.abspath(filename), str(stat.st_size), str(stat.st_mtime_ns)])
+
+
+def is_converted(filename, prefix):
+    """
+    :return: whether both converted files exist at prefix, and its sidecar file records that they were converted from
+             the current version of filename
+    """
+    try:
+        with open(prefix + SOURCE_SUFFIX, encoding="utf-8") as f:
+            source = json.load(f)
+    except (IOError, ValueError):
+        return False
+    return source.get("digest") == source_digest(filename) and \
+        os.path.exists(prefix + WORDS_SUFFIX) and os.path.exists(prefix + MATRIX_SUFFIX)
+
+
+def load_w2v_subset(filename, mmap_dir, words):
+    """
+    Load vectors for a subset of the vocabulary, converting the word2vec file to memory-mappable form on first use,
+    so that memory use depends on the number of words requested rather than on the size of the model
+    :param filename: word2vec binary file
+    :param mmap_dir: directory to keep converted files in
+    :param words: set of words to load
+    :return: matrix with one row per word found, dict of word -> row
+    """
+    os.makedirs(mmap_dir, exist_ok=True)
+    # Named by the absolute path too, so that models with the same file name in different directories do not clash
+    prefix = os.path.join(mmap_dir, "%s_%s" % (os.path.splitext(os.path.basename(filename))[0],
+                                               strings_digest([os.path.abspath(filename)])[:12]))
+    if not is_converted(filename, prefix):
+        digest = source_digest(filename)
+        convert_w2v(filename, prefix)
+        with atomic_write(prefix + SOURCE_SUFFIX, "w", encoding="utf-8") as f:  # last, once both files are in place
+            json.dump(dict(source=os.path.abspath(filename), digest=digest), f)
+    vectors = np.load(prefix + MATRIX_SUFFIX, mmap_mode="r")
+    rows = []
+    enum = {}
+    with open(prefix + WORDS_SUFFIX, encoding="utf-8") as f:
+        for i, word in enumerate(line.rstrip("\n") for line in f):
+            if word in words and word not in enum:
+                enum[word] = len(rows)
+                rows.append(i)
+    return vectors[np.array(rows, dtype=int)], enum
@@ -3,12 +3,14 @@ from argparse import ArgumentParser
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
-from cooccur.io import load_sub_counts
-from evaluation.benchmark import load_benchmark, extract_all_concepts, CONCEPT_COLUMNS
+from evaluation.benchmark import load_benchmark, extract_all_concepts, concept_ids, CONCEPT_COLUMNS
 from evaluation.evaluate_partition import print_correlations
+from evaluation.measures import batches, dot_rows, js_rows, euclidean_rows, sum_rows
+from evaluation.sweep import load_sub_counts, load_sparse_sub_counts
 from sib.joint_distribution import JointDistribution
-from sib.misc import normalize, js
+from sib.misc import normalize
 
 np.warnings.filterwarnings("ignore")
 
@@ -18,32 +20,30 @@ MEASURES = ["pmi1", "pmi2", "dot p(y|x)", "-js p(y|x)", "-eu p(y|x)", "weighted
 def main(args):
     df = load_benchmark(args.benchmark, train_only=True)
     num_pairs = len(df)
-    m, enum = load_sub_counts(args.counts, args.titles, extract_all_concepts(df))
+    if args.sparse and args.counts.endswith(".npz"):
+        m, enum = load_sparse_sub_counts(args.counts, args.titles, extract_all_concepts(df))
+    else:
+        m, enum = load_sub_counts(args.counts, args.titles, extract_all_concepts(df))
+        if args.sparse:
+            m = sparse.csr_matrix(m)
     if args.normalize:
-        m = normalize(m)
-    pmi1 = pmi(m)
-    pmi2 = pmi(pmi1)
-    dist = JointDistribution(py_x=normalize(m).T, pxy=m / np.sum(m))
-    empty_scores = np.empty((num_pairs, len(MEASURES)))
-    empty_scores.fill(np.nan)
-    scores = pd.DataFrame(empty_scores, index=df.index, columns=MEASURES)
-    num_pairs_found = 0
+        m = normalize_sparse(m) if args.sparse else normalize(m)
+    pmi1 = pmi(m, args.shift)
+    pmi2 = pmi(pmi1, args.shift)
+    if args.sparse:  # only p(y|x) and p(x) are needed for scoring
+        py_x, px = normalize_sparse(m), sum_rows(m) / m.sum()
+        undefined1 = undefined_pmi_rows(m)
+        undefined2 = undefined_pmi_rows(pmi1, undefined1)
+    else:
+        dist = JointDistribution(py_x=normalize(m).T, pxy=m / np.sum(m))
+        py_x, px = dist.py_x.T, dist.px
+        undefined1 = undefined2 = None
     print("Evaluating on benchmark concepts... ", end="")
-    for i, source, target in df[CONCEPT_COLUMNS].itertuples():
-        try:
-            x1, x2 = enum[source], enum[target]
-        except KeyError:
-            continue
-        num_pairs_found += 1
-        scores.iloc[i] = (
-            pmi1[x1].dot(pmi1[x2]),
-            pmi2[x1].dot(pmi2[x2]),
-            dist.py_x[:, x1].dot(dist.py_x[:, x2]),
-            -js(dist.py_x[:, x1], dist.py_x[:, x2]),
-            -euclidean_distance(dist.py_x[:, x1], (dist.py_x[:, x2])),
-            -js(dist.py_x[:, x1], dist.py_x[:, x2], dist.px[x1] / (dist.px[x1] + dist.px[x2])),
-        )
-    print("calculated scores for %f%% of pairs" % (num_pairs_found / num_pairs * 100))
+    found, x1, x2 = concept_ids(df, enum)
+    scores = np.full((num_pairs, len(MEASURES)), np.nan)
+    scores[found] = score_pairs(x1, x2, pmi1, pmi2, py_x, px, undefined1, undefined2)
+    print("calculated scores for %f%% of pairs" % (found.sum() / num_pairs * 100))
+    scores = pd.DataFrame(scores, index=df.index, columns=MEASURES)
     scores = scores.apply(lambda x: x.fillna(x.mean()), axis=0)  # replace NaN values with column mean
     print_correlations(df, scores)
     basename = args.out_dir + os.path.sep + os.path.basename(os.path.splitext(args.counts)[0])
@@ -52,7 +52,40 @@ def main(args):
     print("Wrote report to '%s'" % report_filename)
 
 
-def pmi(m):
+def score_pairs(x1, x2, pmi1, pmi2, py_x, px, undefined1=None, undefined2=None):
+    """
+    Calculate all MEASURES for concept pairs, one batch of pairs at a time
+    :param x1: array of source concept IDs
+    :param x2: array of target concept IDs
+    :param pmi1: PMI matrix with concepts as rows (dense or CSR)
+    :param pmi2: PMI of PMI matrix with concepts as rows (dense or CSR)
+    :param py_x: p(y|x) matrix with concepts as rows (dense or CSR)
+    :param px: array of p(x) per concept
+    :param undefined1: boolean array marking concepts with undefined (NaN) PMI, where pmi1 is sparse (optional)
+    :param undefined2: boolean array marking concepts with undefined (NaN) PMI of PMI, where pmi2 is sparse (optional)
+    :return: array of scores with pairs as rows and MEASURES as columns
+    """
+    scores = np.empty((len(x1), len(MEASURES)))
+    for batch in batches(len(x1)):
+        b1, b2 = x1[batch], x2[batch]
+        p1, p2 = py_x[b1], py_x[b2]
+        scores[batch] = np.column_stack((
+            dot_rows(pmi1[b1], pmi1[b2]),
+            dot_rows(pmi2[b1], pmi2[b2]),
+            dot_rows(p1, p2),
+            -js_rows(p1, p2),
+            -euclidean_rows(p1, p2),
+            -js_rows(p1, p2, px[b1] / (px[b1] + px[b2])),
+        ))
+        for column, undefined in enumerate((undefined1, undefined2)):
+            if undefined is not None:
+                scores[batch, column][undefined[b1] | undefined[b2]] = np.nan
+    return scores
+
+
+def pmi(m, k=1):
+    if sparse.issparse(m):
+        return sparse_pmi(m, k)
     m = m.astype(float)
     marginal_word = m.sum(axis=1)
     marginal_context = m.sum(axis=0)
@@ -60,12 +93,48 @@ def pmi(m):
     m /= marginal_context  # #(w, c) / (#w * #c)
     m *= marginal_word.sum()  # #(w, c) * D / (#w * #c)
     np.log(m, out=m)  # PMI = log(#(w, c) * D / (#w * #c))
+    if k != 1:
+        m -= np.log(k)
     m.clip(0.0, out=m)  # SPPMI = max(0, log(#(w, c) * D / (#w * #c)) - log(k))
     return m
 
 
-def euclidean_distance(x, y):
-    return np.sqrt(np.dot(x - y, x - y))
+def sparse_pmi(m, k=1):
+    """
+    Calculate SPPMI = max(0, log(#(w, c) * D / (#w * #c)) - log(k)) on the nonzero entries only
+    :param m: sparse co-occurrence matrix with words as rows and contexts as columns
+    :param k: shift, as in negative sampling with k samples
+    :return: CSR matrix with the same sparsity pattern, minus entries clipped to zero
+    """
+    m = sparse.csr_matrix(m, dtype=float, copy=True)
+    marginal_word = sum_rows(m)
+    marginal_context = np.asarray(m.sum(axis=0)).ravel()
+    rows = np.repeat(np.arange(m.shape[0]), np.diff(m.indptr))
+    m.data *= marginal_word.sum() / (marginal_word[rows] * marginal_context[m.indices])
+    np.log(m.data, out=m.data)
+    m.data -= np.log(k)
+    m.data.clip(0.0, out=m.data)
+    m.eliminate_zeros()
+    return m
+
+
+def undefined_pmi_rows(m, undefined=None):
+    """
+    Find the rows that the dense PMI calculation leaves NaN, as 0 / 0 propagates: rows with zero marginal, or all rows
+    if any column has zero marginal or any row of m is itself undefined
+    :param m: sparse matrix to calculate PMI of
+    :param undefined: boolean array marking rows of m that are undefined (optional)
+    :return: boolean array marking the undefined rows of pmi(m)
+    """
+    if (undefined is not None and undefined.any()) or (np.asarray(m.sum(axis=0)).ravel() == 0).any():
+        return np.ones(m.shape[0], dtype=bool)
+    return sum_rows(m) == 0
+
+
+def normalize_sparse(m):
+    """Normalize rows of a sparse matrix to sum to 1"""
+    with np.errstate(divide="ignore"):
+        return sparse.diags(np.nan_to_num(1 / sum_rows(m), posinf=0)).dot(m).tocsr()
 
 
 if __name__ == "__main__":
@@ -75,4 +144,9 @@ if __name__ == "__main__":
     argparser.add_argument("benchmark")
     argparser.add_argument("--out-dir", default="reports")
     argparser.add_argument("--normalize", action="store_true")
+    argparser.add_argument("--sparse", action="store_true",
+                           help="Keep counts in CSR form and calculate PMI only on nonzero entries. Counts in a .npz "
+                                "file saved by scipy.sparse.save_npz (a row per title) are loaded straight into CSR; "
+                                "others are loaded dense first")
+    argparser.add_argument("-k", "--shift", type=float, default=1, help="Shift PMI by log(k), as in SPPMI")
     main(argparser.parse_args())
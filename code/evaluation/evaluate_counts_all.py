@@ -1,33 +1,36 @@
+import os
 from argparse import ArgumentParser
 from collections import namedtuple
-from glob import glob
-from itertools import product
 
+from evaluation import benchmark
 from evaluation import evaluate_counts
+from evaluation import evaluate_partition
+from evaluation import measures
+from evaluation import sweep
 
 CONFIG_FILE = "evaluate_counts.config"
+R = "reports"
+B = "evaluation/benchmarks/WCRD_with_title.csv"
+
+
+def run_task(c, t):
+    evaluate_counts.main(namedtuple("args", "counts titles benchmark out_dir normalize sparse shift")(
+        c, t, B, R, False, False, 1))
+
+
+def task_outputs(c, t):
+    return [os.path.join(R, os.path.basename(os.path.splitext(c)[0]) + "_benchmark_report_raw.csv")]
 
 
 def main(args):
-    print("Loading config from '%s'..." % CONFIG_FILE)
-    with open(CONFIG_FILE) as f:
-        configs = map(str.split, filter(None, f.readlines()))
-    R = "reports"
-    E = "exported"
-    B = "evaluation/benchmarks/WCRD_with_title.csv"
-    c_hist = set()
-    for line in configs:
-        for c, t in product(*map(glob, line)):
-            if c in c_hist:
-                continue
-            c_hist.add(c)
-            print("-- %s %s" % (c, t))
-            try:
-                evaluate_counts.main(namedtuple("args", "counts titles benchmark out_dir, normalize")(c, t, B, R, False))
-            except IOError:
-                print("Not found.")
+    tasks = sweep.read_config(CONFIG_FILE, key_index=0)
+    sweep.run(run_task, tasks, jobs=args.jobs, manifest=os.path.join(R, "evaluate_counts_manifest.json"), inputs=[B],
+              modules=[benchmark, evaluate_counts, evaluate_partition, measures, sweep], force=args.force,
+              outputs=task_outputs)
 
 
 if __name__ == "__main__":
     argparser = ArgumentParser(description="Evaluate all count matrices on concept relatedness benchmark")
+    argparser.add_argument("-f", "--force", action="store_true", help="Run also tasks that are up to date")
+    argparser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes")
     main(argparser.parse_args())
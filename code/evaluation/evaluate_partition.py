@@ -3,11 +3,12 @@ from argparse import ArgumentParser
 
 import numpy as np
 import pandas as pd
-from scipy import spatial
+from scipy import sparse
 
-from cooccur.io import load_sub_counts
-from evaluation.benchmark import load_benchmark, extract_all_concepts, CONCEPT_COLUMNS, CLUSTER_MEASURES, CORR_METHODS
-from sib.misc import js
+from evaluation.benchmark import load_benchmark, extract_all_concepts, concept_ids, CONCEPT_COLUMNS, \
+    CLUSTER_MEASURES, CORR_METHODS
+from evaluation.measures import batches, dot_rows, js_rows, unit_rows
+from evaluation.sweep import load_sub_counts
 from sib.partition import load_partition
 from sib.sequential_information_bottleneck import calc_distances
 
@@ -18,28 +19,12 @@ def main(args):
     num_pairs = len(df)
     m, enum = load_sub_counts(args.counts, args.titles, extract_all_concepts(df), len(T.pt_x))
     dist = calc_distances(T, m, args.uniform_prior)
-    empty_scores = np.empty((num_pairs, len(CLUSTER_MEASURES)))
-    empty_scores.fill(np.nan)
-    scores = pd.DataFrame(empty_scores, index=df.index, columns=CLUSTER_MEASURES)
-    num_pairs_found = 0
     print("Evaluating on benchmark concepts... ", end="")
-    for i, source, target in df[CONCEPT_COLUMNS].itertuples():
-        try:
-            x1, x2 = enum[source], enum[target]
-        except KeyError:
-            continue
-        num_pairs_found += 1
-        t1, t2 = T.pt_x[[x1, x2]]
-        scores.iloc[i] = (
-            t1 == t2,
-            -js(dist.py_x[:, x1], dist.py_x[:, x2]),
-            -T.costs[T.pt_x == t1, t2].mean(),
-            -(T.costs[x1, t2] + T.costs[x2, t1]) / 2,
-            -spatial.distance.cosine(T.costs[x1], T.costs[x2]),
-            -spatial.distance.cosine(dist.py_x[:, x1], dist.py_x[:, x2]),
-            df["score"][i],
-        )
-    print("calculated scores for %f%% of pairs" % (num_pairs_found / num_pairs * 100))
+    found, x1, x2 = concept_ids(df, enum)
+    scores = np.full((num_pairs, len(CLUSTER_MEASURES)), np.nan)
+    scores[found] = score_pairs(x1, x2, dist, T, df["score"].values[found])
+    print("calculated scores for %f%% of pairs" % (found.sum() / num_pairs * 100))
+    scores = pd.DataFrame(scores, index=df.index, columns=CLUSTER_MEASURES)
     scores = scores.apply(lambda x: x.fillna(x.mean()), axis=0)  # replace NaN values with column mean
     print_correlations(df, scores)
     basename = args.out_dir + os.path.sep + os.path.basename(os.path.splitext(args.partition)[0])
@@ -48,6 +33,47 @@ def main(args):
     print("Wrote report to '%s'" % report_filename)
 
 
+def cluster_mean_costs(T):
+    """
+    Calculate the mean cost of the members of each cluster to each cluster, grouping by T.pt_x in one pass
+    :param T: Partition object
+    :return: matrix of shape (T.size, T.size), where [t1, t2] is the mean of T.costs[x, t2] over x in cluster t1
+    """
+    num_concepts = len(T.pt_x)
+    membership = sparse.csr_matrix((np.ones(num_concepts), (T.pt_x, np.arange(num_concepts))),
+                                   shape=(T.size, num_concepts))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return membership.dot(T.costs) / np.asarray(membership.sum(axis=1))
+
+
+def score_pairs(x1, x2, dist, T, gold):
+    """
+    Calculate all CLUSTER_MEASURES for concept pairs
+    :param x1: array of source concept IDs
+    :param x2: array of target concept IDs
+    :param dist: JointDistribution object to use for co-occurrence-based measures
+    :param T: Partition object to use for clustering-based measures
+    :param gold: array of gold scores for the pairs
+    :return: array of scores with pairs as rows and CLUSTER_MEASURES as columns
+    """
+    t1, t2 = T.pt_x[x1], T.pt_x[x2]
+    cluster_costs = cluster_mean_costs(T)
+    unit_costs = unit_rows(T.costs)
+    concepts, inverse = np.unique(np.concatenate((x1, x2)), return_inverse=True)
+    i1, i2 = inverse[:len(x1)], inverse[len(x1):]
+    py_x = dist.py_x[:, concepts].T  # only benchmark concepts, as rows
+    unit_py_x = unit_rows(py_x)
+    return np.column_stack((
+        t1 == t2,
+        np.concatenate([-js_rows(py_x[i1[b]], py_x[i2[b]]) for b in batches(len(x1))] or [[]]),
+        -cluster_costs[t1, t2],
+        -(T.costs[x1, t2] + T.costs[x2, t1]) / 2,
+        dot_rows(unit_costs[x1], unit_costs[x2]) - 1,
+        dot_rows(unit_py_x[i1], unit_py_x[i2]) - 1,
+        gold,
+    ))
+
+
 def print_correlations(benchmark, scores):
     # noinspection PyStringFormat
     print("distance measure              %s correlation    %s correlation" % tuple(CORR_METHODS))
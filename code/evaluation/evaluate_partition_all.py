@@ -1,44 +1,51 @@
+import os
 from argparse import ArgumentParser
 from collections import namedtuple
-from glob import glob
-from itertools import product
+from functools import partial
 
 from analytics import report
 from analytics import visualize
+from evaluation import benchmark
 from evaluation import evaluate_partition
+from evaluation import measures
+from evaluation import sweep
 from util import export
 
 CONFIG_FILE = "evaluate_partition.config"
+R = "reports"
+E = "exported"
+B = "evaluation/benchmarks/WCRD_with_title.csv"
+
+
+def run_task(c, p, t, benchmark_=True, report_=True, visualize_=True, export_=True):
+    u = "uniform" in p
+    if benchmark_:
+        evaluate_partition.main(namedtuple("args", "counts partition titles benchmark uniform_prior "
+                                                   "out_dir")(c, p, t, B, u, R))
+    if report_:
+        report.main(namedtuple("args", "counts partition titles out_dir all")(c, p, t, R, False))
+    if visualize_:
+        visualize.main(namedtuple("args", "partition titles out_dir distances")(p, t, R, True))
+    if export_:
+        export.main(namedtuple("args", "counts partition titles benchmark uniform_prior "
+                                       "out_dir")(c, p, t, B, u, E))
+
+
+def task_outputs(c, p, t, benchmark_=True, report_=True, visualize_=True, export_=True):
+    """Files written by run_task, except by export, whose file names are up to it"""
+    basename = os.path.join(R, os.path.basename(os.path.splitext(p)[0]))
+    return ([basename + "_benchmark_report.csv"] if benchmark_ else []) + \
+        ([basename + "_report.csv", basename + ".png"] if report_ else []) + \
+        ([basename + "_distances.csv", basename + "_plot.png"] if visualize_ else [])
 
 
 def main(args):
-    print("Loading config from '%s'..." % CONFIG_FILE)
-    with open(CONFIG_FILE) as f:
-        configs = map(str.split, filter(None, f.readlines()))
-    R = "reports"
-    E = "exported"
-    B = "evaluation/benchmarks/WCRD_with_title.csv"
-    p_hist = set()
-    for line in configs:
-        for c, p, t in product(*map(glob, line)):
-            if p in p_hist:
-                continue
-            p_hist.add(p)
-            print("-- %s %s %s" % (c, p, t))
-            try:
-                u = "uniform" in p
-                if args.benchmark:
-                    evaluate_partition.main(namedtuple("args", "counts partition titles benchmark uniform_prior "
-                                                               "out_dir")(c, p, t, B, u, R))
-                if args.report:
-                    report.main(namedtuple("args", "counts partition titles out_dir all")(c, p, t, R, False))
-                if args.visualize:
-                    visualize.main(namedtuple("args", "partition titles out_dir distances")(p, t, R, True))
-                if args.export:
-                    export.main(namedtuple("args", "counts partition titles benchmark uniform_prior "
-                                                   "out_dir")(c, p, t, B, u, E))
-            except IOError:
-                print("Not found.")
+    tasks = sweep.read_config(CONFIG_FILE, key_index=1)
+    flags = dict(benchmark_=args.benchmark, report_=args.report, visualize_=args.visualize, export_=args.export)
+    sweep.run(partial(run_task, **flags), tasks, jobs=args.jobs,
+              manifest=os.path.join(R, "evaluate_partition_manifest.json"), inputs=[B],
+              modules=[benchmark, evaluate_partition, measures, sweep, report, visualize, export], params=flags,
+              force=args.force, outputs=partial(task_outputs, **flags))
 
 
 if __name__ == "__main__":
@@ -48,4 +55,6 @@ if __name__ == "__main__":
     argparser.add_argument("--no-report", dest="report", action="store_false")
     argparser.add_argument("--no-visualize", dest="visualize", action="store_false")
     argparser.add_argument("--no-export", dest="export", action="store_false")
+    argparser.add_argument("-f", "--force", action="store_true", help="Run also tasks that are up to date")
+    argparser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes")
     main(argparser.parse_args())
@@ -5,12 +5,13 @@ from argparse import ArgumentParser
 
 import numpy as np
 import pandas as pd
-from scipy import spatial
+from scipy import sparse
 from tqdm import tqdm
 
 from cooccur.io import load_sub_counts
+from evaluation.measures import batches, cosine_rows, js_rows
 from sib.joint_distribution import JointDistribution
-from sib.misc import js, normalize
+from sib.misc import normalize
 from sib.partition import load_partition
 from sib.sequential_information_bottleneck import calc_distances
 
@@ -28,6 +29,7 @@ CLUSTER_MEASURES = [
 GOLD_MEASURES = [
     "confidence",
 ]
+MAX_BATCH_ELEMENTS = 1 << 24  # bound on the size of the dense (sentences x y) representations of a batch
 
 
 def load_benchmark(filename):
@@ -72,31 +74,56 @@ def print_evaluation(gold, scores):
         print("%-22s" % "%.3f" % (100 * accuracy(gold, scores[measure])))
 
 
-def sim(x1, x2, dist, T=None, idf=None):
+def encode_sentences(sentences, enum, num_columns, idf=None, drop_missing=False):
     """
-    Calculate similarities between two sets of concepts
-    :param x1: one set of concept IDs
-    :param x2: another set of concept IDs
-    :param dist: JointDistribution object to use for co-occurrence-based measures
-    :param T: Partition object to use for clustering-based measures (optional)
+    Encode sentences as a sparse matrix of concept weights, so that multiplying it by p(y|x) averages over concepts
+    :param sentences: list of lists of concepts
+    :param enum: dict of concept -> ID
+    :param num_columns: number of concepts with p(y|x); column num_columns stands for all concepts without
     :param idf: array of IDF per concept (by ID)
-    :return: array of similarity values
+    :param drop_missing: omit concepts without counts from calculation, unless none is left
+    :return: CSR matrix of shape (len(sentences), num_columns + 1), and the number of concept IDs used
     """
-    # average p(y|x) over sentence concepts, weighted by IDF
-    p1, p2 = [dist.py_x[:, np.clip(x, None, dist.py_x.shape[1] - 1)].dot(
-        np.ones(len(x)) if idf is None else 100-idf[x]) / len(x)
-        for x in (x1, x2)]
-    assert len(p1) and len(p2), "Empty representation"
-    ret = (
-        -spatial.distance.cosine(p1, p2),
-        -js(p1, p2),
-    )
-    if T:
-        ret += (
-            -spatial.distance.cosine(p1, p2),
-            -js(p1, p2),
-        )
-    return ret
+    ids = []
+    lengths = []
+    for concepts in sentences:
+        x = [enum.get(c, -1) for c in concepts] or [-1]
+        if drop_missing:
+            x = [xi for xi in x if xi != -1] or [-1]
+        ids += x
+        lengths.append(len(x))
+    ids = np.array(ids, dtype=int)
+    lengths = np.array(lengths, dtype=int)
+    weights = np.ones(len(ids)) if idf is None else 100 - idf[ids]
+    columns = np.where((ids < 0) | (ids >= num_columns), num_columns, ids)
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    return sparse.csr_matrix((weights / np.repeat(lengths, lengths), columns, indptr),
+                             shape=(len(sentences), num_columns + 1)), len(ids)
+
+
+def score_triplets(sentences, py_x, clusters=False):
+    """
+    Calculate similarity of the pivot to sentence1 minus its similarity to sentence2, for all triplets in batches
+    of at most MAX_BATCH_ELEMENTS elements of dense representations
+    :param sentences: matrix from encode_sentences, with the pivot, sentence1 and sentence2 of each triplet in a row
+    :param py_x: p(y|x) matrix with concepts as columns
+    :param clusters: whether to add CLUSTER_MEASURES after DIST_MEASURES
+    :return: array with triplets as rows and measures as columns
+    """
+    num_y, num_columns = py_x.shape
+    scores = []
+    for batch in batches(sentences.shape[0] // 3, max(1, MAX_BATCH_ELEMENTS // (3 * num_y))):
+        rows = sentences[3 * batch.start:3 * batch.stop]
+        p = rows[:, :num_columns].dot(py_x.T)
+        if sparse.issparse(p):
+            p = p.toarray()
+        p = p + rows[:, num_columns].toarray() / num_y  # concepts without counts get uniform p(y|x)
+        pivot, p1, p2 = p[0::3], p[1::3], p[2::3]
+        batch_scores = [cosine_rows(pivot, p2) - cosine_rows(pivot, p1), js_rows(pivot, p2) - js_rows(pivot, p1)]
+        if clusters:
+            batch_scores *= 2
+        scores.append(np.column_stack(batch_scores))
+    return np.concatenate(scores)
 
 
 def main(args):
@@ -117,22 +144,13 @@ def main(args):
             T = None
             dist = JointDistribution(py_x=normalize(m).T, pxy=m / np.sum(m))
         measures += GOLD_MEASURES
-        empty_scores = np.empty((num_triplets, len(measures)))
-        empty_scores.fill(np.nan)
         gold = df[GOLD_MEASURES[0]]
-        scores = pd.DataFrame(empty_scores, index=df.index, columns=measures)
-        num_concepts = num_concepts_found = 0
-        dist.py_x = np.append(dist.py_x, np.ones((dist.py_x.shape[0], 1)) / dist.py_x.shape[0], axis=1)
-        for j, *sentences in tqdm(df[CONCEPT_COLUMNS].itertuples(), unit=" triplets", total=num_triplets,
-                                  desc="Evaluating on benchmark sentence triplets", file=sys.stdout):
-            concepts = list(map(split, sentences))  # three lists of strings
-            num_concepts += sum(map(len, concepts))
-            x = [np.array([enum.get(c, -1) for c in cs] or [-1], dtype=int) for cs in concepts]
-            if args.drop_missing:
-                x = [np.array([xii for xii in xi if xii != -1] or [-1], dtype=int) for xi in x]
-            num_concepts_found += sum(map(len, x))
-            measure_scores = [s1 - s2 for s1, s2 in zip(*[sim(x1, x2, dist, T, idf) for x1, x2 in (x[0:2], x[0:3:2])])]
-            scores.iloc[j] = measure_scores + [gold[j]]
+        sentences = [split(cs) for triplet in df[CONCEPT_COLUMNS].itertuples(index=False) for cs in triplet]
+        num_concepts = sum(map(len, sentences))
+        print("Evaluating on %d benchmark sentence triplets..." % num_triplets)
+        encoded, num_concepts_found = encode_sentences(sentences, enum, dist.py_x.shape[1], idf, args.drop_missing)
+        scores = pd.DataFrame(np.column_stack((score_triplets(encoded, dist.py_x, T is not None), gold.values)),
+                              index=df.index, columns=measures)
         print("Calculated scores for %.1f%% of concepts" % (num_concepts_found / num_concepts * 100))
         scores = scores.apply(lambda v: v.fillna(v.mean()), axis=0)  # replace NaN with column mean
         print_evaluation(gold, scores)
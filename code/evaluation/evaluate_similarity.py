@@ -6,29 +6,38 @@ import pandas as pd
 
 from cooccur.io import load_counts, load_enum, load_w2v
 from evaluation.benchmark import CORR_METHODS, BENCHMARKS, WORD_COLUMNS
+from evaluation.cache import cache_filename, atomic_write, file_digest, strings_digest, CACHE_DIR
+from evaluation.embeddings import load_w2v_subset
 from sib.joint_distribution import JointDistribution
 from sib.misc import normalize, js
 
 np.warnings.filterwarnings("ignore")
 
 MEASURES = ["1 - js p(y|x)", "weighted js"]
+CASINGS = ("lower", "title", "upper")  # tried in this order after the word as is
 
 
 def main(args):
     # m, enum = load_sub_counts(args.counts, args.titles, set(pd.concat(map(df.get, WORD_COLUMNS))))
+    words = benchmark_words()
     if args.counts.endswith(".bin"):
-        vectors, enum = load_w2v(args.counts)
+        if args.mmap_dir:
+            vectors, enum = load_w2v_subset(args.counts, args.mmap_dir, casing_variants(words))
+        else:
+            vectors, enum = load_w2v(args.counts)
         dist = JointDistribution(py_x=vectors.T)
     else:
         m, enum = load_counts(args.counts), load_enum(args.titles)
         if args.normalize:
             m = normalize(m)
         dist = JointDistribution(py_x=normalize(m).T, pxy=m / np.sum(m))
+    word_index = load_word_index(enum, words, None if args.counts.endswith(".bin") else args.titles,
+                                 cache_dir=args.cache_dir)
     measures = MEASURES if args.weighted_js else MEASURES[:-1]
     results = []
     for benchmark in BENCHMARKS:
         basename = args.out_dir + os.path.sep + os.path.basename(os.path.splitext(args.counts)[0])
-        results.append(create_report(basename, benchmark, dist, enum, measures, weighted_js=args.weighted_js,
+        results.append(create_report(basename, benchmark, dist, word_index, measures, weighted_js=args.weighted_js,
                                      average_missing=args.average_missing))
     print()
     # noinspection PyStringFormat
@@ -41,13 +50,65 @@ def main(args):
             print()
 
 
-def create_report(basename, benchmark, dist, enum, measures, weighted_js=False, average_missing=False):
-    def _enum_get(word):
-        for func in (str, str.lower, str.title, str.upper):
-            index = enum.get(func(word))
-            if index is not None:
-                return index
-        return None
+def benchmark_words():
+    """:return: sorted list of all distinct tokens in the word columns of all benchmarks"""
+    words = set()
+    for benchmark in BENCHMARKS:
+        df = benchmark.load(verbose=False)
+        for column in WORD_COLUMNS:
+            words.update(word for item in df[column].dropna() for word in item.split())
+    return sorted(words)
+
+
+def casing_variants(words):
+    """:return: set of all words in all casings tried when looking them up"""
+    return set(words).union(*(getattr(pd.Series(list(words), dtype=object).str, casing)() for casing in CASINGS))
+
+
+def build_word_index(enum, words):
+    """
+    Resolve all words against the enum at once, trying each word as is and then in each of CASINGS
+    :param enum: dict of word -> ID
+    :param words: list of words
+    :return: dict of word -> ID, for the words found in any casing
+    """
+    words = pd.Series(list(words), dtype=object)
+    enum = pd.Series(enum, dtype=object)
+    ids = words.map(enum)
+    for casing in CASINGS:
+        ids = ids.fillna(getattr(words.str, casing)().map(enum))
+    found = ids.notna()
+    return dict(zip(words[found], ids[found].astype(int)))
+
+
+def load_word_index(enum, words, enum_file=None, cache_dir=None):
+    """
+    Build the word index, or load it from the cache directory if it was already built for the same enum file
+    :param enum: dict of word -> ID
+    :param words: list of words
+    :param enum_file: file the enum was loaded from, to key the cache by its contents (no caching if not given)
+    :param cache_dir: cache directory to use instead of CACHE_DIR
+    :return: dict of word -> ID, for the words found in any casing
+    """
+    if not enum_file:
+        return build_word_index(enum, words)
+    filename = cache_filename("word_index", "%s_%s.npz" % (file_digest(enum_file), strings_digest(words)), cache_dir)
+    try:
+        with np.load(filename) as f:
+            return dict(zip(f["words"].tolist(), f["ids"].tolist()))
+    except (IOError, KeyError, ValueError):
+        pass
+    word_index = build_word_index(enum, words)
+    try:
+        with atomic_write(filename) as f:
+            np.savez(f, words=np.array(list(word_index), dtype=str),
+                     ids=np.array(list(word_index.values()), dtype=np.int64))
+    except OSError:  # read-only cache directory: just use the index built now
+        pass
+    return word_index
+
+
+def create_report(basename, benchmark, dist, word_index, measures, weighted_js=False, average_missing=False):
     df = benchmark.load(verbose=False)
     num_pairs = len(df)
     empty_scores = np.empty((num_pairs, len(measures)))
@@ -56,7 +117,7 @@ def create_report(basename, benchmark, dist, enum, measures, weighted_js=False,
     num_pairs_found = 0
     print("Evaluating on %d pairs from the %s benchmark... " % (num_pairs, benchmark.name), end="")
     for i, source, target in df[WORD_COLUMNS].itertuples():
-        x1, x2 = [list(filter(None, map(_enum_get, item.split()))) for item in (source, target)]
+        x1, x2 = [[word_index[word] for word in item.split() if word in word_index] for item in (source, target)]
         if x1 and x2:
             num_pairs_found += 1
             p1, p2 = [dist.py_x[:, x].mean(axis=1) for x in (x1, x2)]
@@ -81,4 +142,8 @@ if __name__ == "__main__":
     argparser.add_argument("--normalize", action="store_true")
     argparser.add_argument("--weighted-js", action="store_true")
     argparser.add_argument("--average-missing", action="store_true")
+    argparser.add_argument("--mmap-dir",
+                           help="Directory to convert .bin files (word2vec binary format only, not fastText .bin "
+                                "models) to memory-mapped form in, to load only the vectors of benchmark words")
+    argparser.add_argument("--cache-dir", help="Directory for cached word indices (default: %s)" % CACHE_DIR)
     main(argparser.parse_args())
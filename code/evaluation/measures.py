@@ -0,0 +1,67 @@
+import numpy as np
+from scipy import sparse
+from scipy.special import xlogy
+
+BATCH_SIZE = 1024  # number of rows to compare at once
+
+
+def batches(n, batch_size=BATCH_SIZE):
+    """Generate slices covering range(n) in consecutive batches"""
+    for start in range(0, n, batch_size):
+        yield slice(start, start + batch_size)
+
+
+def sum_rows(m):
+    """Sum along the last axis, returning an array also for sparse matrices"""
+    return np.asarray(m.sum(axis=1)).ravel() if sparse.issparse(m) else m.sum(axis=-1)
+
+
+def dot_rows(a, b):
+    """Dot product along the last axis (of arrays, or row by row for sparse matrices)"""
+    if sparse.issparse(a):
+        return sum_rows(a.multiply(b))
+    return np.einsum("...i,...i->...", a, b)
+
+
+def kl_rows(p, q):
+    """KL divergence along the last axis, where the support of p is contained in the support of q"""
+    if sparse.issparse(p):
+        log_ratio = sparse.csr_matrix(p.multiply(q.power(-1)))  # p / q on the support of p
+        np.log(log_ratio.data, out=log_ratio.data)
+        return sum_rows(p.multiply(log_ratio))
+    return (xlogy(p, p) - xlogy(p, q)).sum(axis=-1)
+
+
+def js_rows(p, q, pi1=.5):
+    """
+    Jensen-Shannon divergence (in bits) along the last axis, broadcasting over the rest
+    :param p: array of distributions (or sparse matrix with distributions as rows)
+    :param q: array of distributions (or sparse matrix with distributions as rows)
+    :param pi1: weight of p (scalar or array broadcastable to the leading axes)
+    :return: array of divergences
+    """
+    pi1 = np.asarray(pi1, dtype=float)
+    pi2 = 1 - pi1
+    if sparse.issparse(p):
+        pi1, pi2 = [np.broadcast_to(pi, p.shape[:1]) for pi in (pi1, pi2)]
+        m = sparse.diags(pi1).dot(p) + sparse.diags(pi2).dot(q)
+    else:
+        m = pi1[..., None] * p + pi2[..., None] * q
+    return (pi1 * kl_rows(p, m) + pi2 * kl_rows(q, m)) / np.log(2)
+
+
+def euclidean_rows(a, b):
+    """Euclidean distance along the last axis"""
+    d = a - b
+    return np.sqrt(dot_rows(d, d))
+
+
+def cosine_rows(a, b):
+    """Cosine distance along the last axis"""
+    return 1 - dot_rows(a, b) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1))
+
+
+def unit_rows(a):
+    """Normalize to unit Euclidean norm along the last axis"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return a / np.linalg.norm(a, axis=-1, keepdims=True)
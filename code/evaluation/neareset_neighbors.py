@@ -1,19 +1,133 @@
 import os
 import sys
+import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
 from tqdm import tqdm
 
 from cooccur.io import load_sub_counts
-from evaluation.evaluate_sentence_relatedness import load_benchmark, extract_all_concepts, sim, \
+from evaluation.evaluate_sentence_relatedness import load_benchmark, extract_all_concepts, \
     DIST_MEASURES, CLUSTER_MEASURES
+from evaluation.measures import batches, js_rows, unit_rows
 from sib.joint_distribution import JointDistribution
 from sib.misc import normalize
 from sib.partition import load_partition
 from sib.sequential_information_bottleneck import calc_distances
 
 NUM_NEAREST_NEIGHBORS = 10
+BLOCK_SIZE = 256  # number of query rows per block
+MAX_BLOCK_ELEMENTS = 1 << 24  # bound on the size of the (queries x candidates x y) JS arrays, over all workers
+
+
+def top_k(scores, k):
+    """Column indices of the k highest scores in each row, highest first"""
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def exclude_self(scores, queries):
+    """Set the score of each query row with itself to -inf"""
+    scores[np.arange(len(queries)), queries] = -np.inf
+    return scores
+
+
+def js_scores(p, queries, max_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Negative JS divergence between the query rows and all rows, calculated in chunks of candidate rows, each chunk's
+    (queries x candidates x y) arrays of at most max_elements
+    """
+    scores = np.empty((len(queries), len(p)))
+    for candidates in batches(len(p), max(1, max_elements // (len(queries) * p.shape[1]))):
+        scores[:, candidates] = -js_rows(p[queries, None, :], p[None, candidates, :])
+    return scores
+
+
+def shortlist_js_neighbors(p, sqrt_p, queries, k, num_candidates, max_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Approximate JS nearest neighbors: shortlist candidates by Hellinger affinity (dot product of square roots of
+    distributions, a metric embedding in which nearest neighbor search is cosine search), then rerank by exact JS.
+    The shortlist is an exact dense cosine pre-filter against all rows, not an index: it is still quadratic, but
+    replaces most of the costly JS calculations with one matrix product.
+    :param p: matrix with distributions as rows
+    :param sqrt_p: square root of p, with rows normalized to unit norm
+    :param queries: indices of rows to find neighbors for
+    :param k: number of neighbors
+    :param num_candidates: shortlist size per query (at least k)
+    :param max_elements: bound on the size of the arrays used to calculate JS at once
+    :return: array with the indices of neighbors of each query, nearest first
+    """
+    affinity = exclude_self(sqrt_p[queries].dot(sqrt_p.T), queries)
+    shortlist = np.argpartition(-affinity, num_candidates - 1, axis=1)[:, :num_candidates]
+    scores = np.empty(shortlist.shape)
+    for rows in batches(len(queries), max(1, max_elements // (num_candidates * p.shape[1]))):
+        scores[rows] = -js_rows(p[queries[rows], None, :], p[shortlist[rows]])
+    return np.take_along_axis(shortlist, top_k(scores, k), axis=1)
+
+
+def block_neighbors(p, unit_p, block, k, sqrt_p=None, num_candidates=None, max_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Find the nearest neighbors of a block of rows among all rows, excluding themselves
+    :param p: matrix with distributions as rows
+    :param unit_p: p with rows normalized to unit norm
+    :param block: slice or array of indices of rows to find neighbors for
+    :param k: number of neighbors
+    :param sqrt_p: square root of p with rows normalized to unit norm, if JS neighbors are to be approximated
+    :param num_candidates: shortlist size per row, if JS neighbors are to be approximated
+    :param max_elements: bound on the size of the arrays used to calculate JS at once
+    :return: pair of arrays with the indices of neighbors by cosine similarity and by JS divergence, nearest first
+    """
+    queries = np.arange(len(p))[block]
+    cosine = exclude_self(unit_p[queries].dot(unit_p.T), queries)
+    if num_candidates:
+        js = shortlist_js_neighbors(p, sqrt_p, queries, k, num_candidates, max_elements)
+    else:
+        js = top_k(exclude_self(js_scores(p, queries, max_elements), queries), k)
+    return top_k(cosine, k), js
+
+
+def nearest_neighbors(p, k, block_size=BLOCK_SIZE, workers=1, num_candidates=None):
+    """
+    Find the nearest neighbors of every row by cosine similarity and by JS divergence, a block of rows at a time
+    :param p: matrix with distributions as rows
+    :param k: number of neighbors per row (at most one less than the number of rows)
+    :param block_size: number of rows per block
+    :param workers: number of threads to process blocks with, sharing MAX_BLOCK_ELEMENTS
+    :param num_candidates: if given, approximate JS neighbors by reranking this many candidates per row
+    :return: pair of arrays of shape (len(p), k) with the indices of neighbors by cosine and by JS, nearest first
+    """
+    k = min(k, len(p) - 1)
+    if k < 1:
+        return [np.empty((len(p), 0), dtype=int)] * 2
+    if num_candidates:
+        num_candidates = min(max(num_candidates, k), len(p) - 1)
+    sqrt_p = unit_rows(np.sqrt(p)) if num_candidates else None
+    blocks = list(batches(len(p), block_size))
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(tqdm(executor.map(partial(block_neighbors, p, unit_rows(p), k=k, sqrt_p=sqrt_p,
+                                                 num_candidates=num_candidates,
+                                                 max_elements=MAX_BLOCK_ELEMENTS // workers), blocks),
+                            total=len(blocks), unit=" blocks", desc="Calculating nearest neighbors", file=sys.stdout))
+    return [np.concatenate(r) for r in zip(*results)]
+
+
+def js_recall(p, neighbors, sample_size, seed=0):
+    """
+    Compare JS neighbors to exact search on a random sample of rows
+    :param p: matrix with distributions as rows
+    :param neighbors: array of JS neighbor indices per row, from approximate search
+    :param sample_size: number of rows to check
+    :param seed: random seed for the sample
+    :return: mean fraction of the exact neighbors found per row, and the time taken by exact search on the sample
+    """
+    k = neighbors.shape[1]
+    sample = np.random.RandomState(seed).choice(len(p), min(sample_size, len(p)), replace=False)
+    start = time.time()
+    exact = top_k(exclude_self(js_scores(p, sample), sample), k)
+    return np.mean([len(set(a).intersection(e)) / k for a, e in zip(neighbors[sample], exact)]), time.time() - start
 
 
 def main(args):
@@ -30,19 +144,25 @@ def main(args):
         else:
             T = None
             dist = JointDistribution(py_x=normalize(m).T, pxy=m / np.sum(m))
-        concepts = [c for c in all_concepts if c in enum]
-        id2concept = {enum[c]: c for c in concepts}
-        neighbors = np.empty((len(measures), len(id2concept), NUM_NEAREST_NEIGHBORS), dtype=object)
-        for j, concept_id in enumerate(tqdm(id2concept, unit=" concepts",
-                                            desc="Calculating nearest neighbors", file=sys.stdout)):
-            scores = np.array([sim([concept_id], [j], dist, T) for j in id2concept if concept_id != j])
-            for n, s in zip(neighbors, scores.T):  # loop over measures
-                n[j, :] = [concepts[k] for k in s.argsort()[::-1][:NUM_NEAREST_NEIGHBORS]]
+        concepts = np.array([c for c in all_concepts if c in enum], dtype=object)
+        p = dist.py_x[:, [enum[c] for c in concepts]].T  # only benchmark concepts, as rows
+        start = time.time()
+        neighbors = nearest_neighbors(p, NUM_NEAREST_NEIGHBORS, args.block_size, args.workers, args.candidates)
+        if args.candidates and args.recall_sample and len(concepts) > 1:
+            duration = time.time() - start
+            recall, exact_duration = js_recall(p, neighbors[1], args.recall_sample)
+            sample_size = min(args.recall_sample, len(concepts))
+            print("Approximate JS neighbors with %d candidates: recall %.3f on %d sampled concepts, took %.1fs "
+                  "(exact search on the sample took %.1fs, about %.1fs for all)" % (
+                      args.candidates, recall, sample_size, duration, exact_duration,
+                      exact_duration * len(concepts) / sample_size))
+        if T:  # cluster measures are calculated the same way as distribution measures
+            neighbors += neighbors
         basename = os.path.join(args.out_dir, os.path.basename(os.path.splitext(counts)[0]))
         for name, n in zip(measures, neighbors):
             report_filename = basename + "_" + name + "_nearest_neighbors.csv"
             np.savetxt(report_filename.translate(str.maketrans(dict.fromkeys("|,()"))),
-                       np.hstack((np.array(concepts)[:, None], n)), delimiter=",", fmt="%s")
+                       np.hstack((concepts[:, None], concepts[n])), delimiter=",", fmt="%s")
             print("Wrote report to '%s'" % report_filename)
 
 
@@ -54,4 +174,12 @@ if __name__ == "__main__":
     argparser.add_argument("-b", "--benchmark", default=os.path.join("sentence_similarity", "labeled_triplets_tw.csv"))
     argparser.add_argument("--no-uniform-prior", action="store_false", dest="uniform_prior")
     argparser.add_argument("--out-dir", default="reports")
+    argparser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="Number of concepts per block")
+    argparser.add_argument("--workers", type=int, default=1, help="Number of threads to process blocks with")
+    argparser.add_argument("-c", "--candidates", type=int,
+                           help="Approximate JS neighbors by reranking this many candidates per concept, shortlisted "
+                                "by an exact cosine pre-filter on square-root distributions (more is slower but more "
+                                "accurate)")
+    argparser.add_argument("--recall-sample", type=int, default=100, help="Number of concepts to check approximate "
+                                                                          "JS neighbors against exact search on")
     main(argparser.parse_args())
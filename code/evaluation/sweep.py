@@ -0,0 +1,307 @@
+import io
+import json
+import math
+import os
+import traceback
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from glob import glob
+from itertools import product
+from multiprocessing import Manager
+from queue import Empty
+
+import numpy as np
+from scipy import sparse
+
+from cooccur import io as cooccur_io
+from evaluation.cache import atomic_write, file_digest, strings_digest
+
+DONE = "done"
+NOT_FOUND = "not found"
+FAILED = "failed"
+STARTED = "started"  # put on the queue by run_tasks before running a task, not a final status
+POLL_INTERVAL = 1  # seconds to wait for a task result before checking whether the workers are done
+
+_sub_counts = {}  # last loaded sub-counts, so that consecutive tasks sharing a counts file load it once
+_counts = {}  # last loaded full counts, likewise
+
+
+def read_only(m):
+    """
+    :param m: dense array or sparse matrix held by a memo
+    :return: read-only view of m if dense, or a copy if sparse, so that one task cannot change what the next one gets
+    """
+    if sparse.issparse(m):
+        return m.copy()
+    view = m.view()
+    view.flags.writeable = False
+    return view
+
+
+def load_sub_counts(counts, titles, concepts, *args, **kwargs):
+    """Memoized cooccur.io.load_sub_counts, keeping just the last result, returned read-only (see read_only)"""
+    key = (counts, titles, frozenset(concepts)) + args + tuple(sorted(kwargs.items()))
+    if key not in _sub_counts:
+        _sub_counts.clear()
+        _sub_counts[key] = cooccur_io.load_sub_counts(counts, titles, concepts, *args, **kwargs)
+    m, enum = _sub_counts[key]
+    return read_only(m), dict(enum)
+
+
+def load_counts(counts):
+    """Memoized cooccur.io.load_counts, keeping just the last result, returned read-only (see read_only)"""
+    if counts not in _counts:
+        _counts.clear()
+        _counts[counts] = cooccur_io.load_counts(counts)
+    return read_only(_counts[counts])
+
+
+def load_sparse_sub_counts(counts, titles, concepts):
+    """
+    Load the rows of the given concepts from a sparse counts file straight into CSR, never creating a dense matrix.
+    Memoized like load_sub_counts.
+    :param counts: .npz file saved by scipy.sparse.save_npz, with a row per title
+    :param titles: titles file, for the row of each concept
+    :param concepts: concepts to load the rows of
+    :return: CSR matrix with a row per concept found, dict of concept -> row
+    """
+    key = (counts, titles, frozenset(concepts), "sparse")
+    if key not in _sub_counts:
+        _sub_counts.clear()
+        enum = cooccur_io.load_enum(titles)
+        found = sorted((enum[concept], concept) for concept in set(concepts) if concept in enum)
+        m = sparse.load_npz(counts).tocsr()[np.array([i for i, _ in found], dtype=int)]
+        _sub_counts[key] = m, {concept: row for row, (_, concept) in enumerate(found)}
+    m, enum = _sub_counts[key]
+    return read_only(m), dict(enum)
+
+
+def read_config(filename, key_index):
+    """
+    Expand each line of a config file, containing space-separated glob patterns, to the cartesian product of files
+    :param filename: config file
+    :param key_index: index of the file in each tuple to remove duplicates by
+    :return: list of file tuples, in order of appearance
+    """
+    print("Loading config from '%s'..." % filename)
+    with open(filename) as f:
+        configs = filter(None, map(str.split, f))
+        tasks = []
+        seen = set()
+        for line in configs:
+            for files in product(*map(glob, line)):
+                if files[key_index] not in seen:
+                    seen.add(files[key_index])
+                    tasks.append(files)
+    return tasks
+
+
+def run_tasks(func, tasks, capture=True, queue=None):
+    """
+    Run tasks one after another
+    :param func: function to call with the files of each task as arguments
+    :param tasks: list of file tuples
+    :param capture: collect the printed output of each task rather than printing it
+    :param queue: queue to put (task, STARTED, "") on before running each task, and each result as soon as its task
+                  completes (optional)
+    :return: list of (task, status, output)
+    """
+    results = []
+    for task in tasks:
+        if queue is not None:
+            queue.put((task, STARTED, ""))
+        out = io.StringIO()
+        if not capture:
+            print("-- %s" % " ".join(task))
+        try:
+            if capture:
+                with redirect_stdout(out):
+                    func(*task)
+            else:
+                func(*task)
+            status = DONE
+        except IOError:
+            status = NOT_FOUND
+            print("Not found.", file=out if capture else None)
+        except Exception:
+            status = FAILED
+            print(traceback.format_exc(), file=out if capture else None)
+        results.append((task, status, out.getvalue()))
+        if queue is not None:
+            queue.put(results[-1])
+    return results
+
+
+def split_groups(tasks, group_index, jobs):
+    """
+    Group tasks sharing the same file at group_index, splitting large groups so that all workers can be kept busy
+    :return: list of lists of tasks
+    """
+    groups = OrderedDict()
+    for task in tasks:
+        groups.setdefault(task[group_index], []).append(task)
+    chunk_size = max(1, math.ceil(len(tasks) / jobs))
+    return [group[i:i + chunk_size] for group in groups.values() for i in range(0, len(group), chunk_size)]
+
+
+def run_pool(func, tasks, jobs, group_index, record):
+    """
+    Run tasks on a process pool, with tasks sharing the file at group_index in the same worker.
+    If a worker dies (e.g., killed for lack of memory), the tasks running at the time are recorded as failed, and the
+    tasks not started yet are run on a new pool.
+    :param func: picklable function to call with the files of each task as arguments
+    :param tasks: list of file tuples
+    :param jobs: number of worker processes
+    :param group_index: index of the file to group tasks by
+    :param record: function to call with each (task, status, output) as soon as the task completes
+    """
+    pending = list(tasks)
+    while pending:
+        started, completed = set(), set()
+        with Manager() as manager, ProcessPoolExecutor(jobs) as executor:
+            queue = manager.Queue()
+            futures = [executor.submit(run_tasks, func, group, queue=queue)
+                       for group in split_groups(pending, group_index, jobs)]
+            while not all(future.done() for future in futures) or not queue.empty():
+                try:
+                    task, status, output = queue.get(timeout=POLL_INTERVAL)
+                except Empty:
+                    continue
+                if status == STARTED:
+                    started.add(task)
+                    continue
+                completed.add(task)
+                print("-- %s\n%s" % (" ".join(task), output), end="", flush=True)
+                record(task, status, output)
+            error = next((future.exception() for future in futures if future.exception() is not None), None)
+        if error is None:
+            return
+        interrupted = [task for task in pending if task not in completed and (task in started or not started)]
+        for task in interrupted:  # if none had started, the pool itself failed: give up on all remaining tasks
+            output = "Worker process failed: %r\n" % error
+            print("-- %s\n%s" % (" ".join(task), output), end="", flush=True)
+            record(task, FAILED, output)
+        pending = [task for task in pending if task not in completed and task not in interrupted]
+        if pending:
+            print("Restarting the pool for the %d remaining tasks" % len(pending), flush=True)
+
+
+def output_state(filename):
+    """:return: [mtime, size] of an output file, or None if it is missing"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class Manifest:
+    """
+    Digests of the inputs and code of completed sweep tasks, and the mtime and size of their outputs, to skip tasks
+    that are up to date. File digests are also kept by path, mtime and size, so unchanged files are not hashed again.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.tasks, self.files = manifest["tasks"], manifest["files"]
+        except (IOError, ValueError, KeyError):
+            self.tasks, self.files = {}, {}
+
+    def file_digest(self, filename):
+        stat = os.stat(filename)
+        entry = self.files.get(filename)
+        if entry is None or entry[:2] != [stat.st_mtime_ns, stat.st_size]:
+            entry = self.files[filename] = [stat.st_mtime_ns, stat.st_size, file_digest(filename)]
+        return entry[2]
+
+    def task_digest(self, task, inputs=(), modules=(), params=None):
+        """
+        :param task: file tuple
+        :param inputs: more input files, shared by all tasks
+        :param modules: modules whose code the task runs
+        :param params: dict of other parameters affecting the task outputs
+        :return: digest of all of the above, or None if an input file is missing
+        """
+        try:
+            digests = [self.file_digest(f) for f in tuple(task) + tuple(inputs)]
+        except OSError:
+            return None
+        digests += [self.file_digest(os.path.realpath(m.__file__)) for m in modules]
+        return strings_digest(digests + [json.dumps(params, sort_keys=True)])
+
+    def is_current(self, task, digest):
+        """
+        :param task: file tuple
+        :param digest: current digest of the task, from task_digest
+        :return: whether the task was completed with the same digest, and its outputs are unchanged since
+        """
+        entry = self.tasks.get(" ".join(task))
+        return digest is not None and isinstance(entry, dict) and entry["digest"] == digest and all(
+            output_state(filename) == state for filename, state in entry["outputs"].items())
+
+    def update(self, task, digest, outputs=()):
+        """
+        Record a completed task
+        :param task: file tuple
+        :param digest: digest of the task, from task_digest
+        :param outputs: files the task writes, to check later (those missing are not)
+        """
+        states = {filename: output_state(filename) for filename in outputs}
+        self.tasks[" ".join(task)] = dict(digest=digest, outputs={f: state for f, state in states.items() if state})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        with atomic_write(self.filename, "w", encoding="utf-8") as f:
+            json.dump(dict(tasks=self.tasks, files=self.files), f, indent=1)
+
+
+def run(func, tasks, jobs=1, group_index=0, manifest=None, inputs=(), modules=(), params=None, force=False,
+        outputs=None):
+    """
+    Run sweep tasks, in this process or on a process pool, and print a summary.
+    With a manifest, each completed task is recorded in it right away, so an interrupted sweep resumes where it stopped.
+    :param func: picklable function to call with the files of each task as arguments
+    :param tasks: list of file tuples
+    :param jobs: number of worker processes
+    :param group_index: index of the counts file in each task, to run tasks sharing it in the same worker
+    :param manifest: manifest file to skip up-to-date tasks by, and to record completed tasks in (optional)
+    :param inputs: more input files, shared by all tasks, for the manifest
+    :param modules: modules whose code the tasks run, for the manifest
+    :param params: dict of other parameters affecting the task outputs, for the manifest
+    :param force: run all tasks even if they are up to date according to the manifest
+    :param outputs: function returning the output files of a task, given its files, for the manifest (optional)
+    :return: list of (task, status, output)
+    """
+    if manifest:
+        manifest = Manifest(manifest)
+        digests = {task: manifest.task_digest(task, inputs, modules, params) for task in tasks}
+        stale = [task for task in tasks if force or not manifest.is_current(task, digests[task])]
+        print("%d of %d tasks are up to date%s" % (len(tasks) - len(stale), len(tasks),
+                                                   " (running all anyway)" if force else ""))
+        tasks = stale
+    results = []
+
+    def _record(task, status, output):
+        results.append((task, status, output))
+        if manifest and status == DONE and digests[task] is not None:
+            manifest.update(task, digests[task], outputs(*task) if outputs else ())
+            manifest.save()
+
+    if jobs == 1:
+        for task in tasks:
+            _record(*run_tasks(func, [task], capture=False)[0])
+    else:
+        run_pool(func, tasks, jobs, group_index, _record)
+    print_summary(results)
+    return results
+
+
+def print_summary(results):
+    statuses = Counter(status for _, status, _ in results)
+    print("Summary: %d tasks, %s" % (len(results), ", ".join("%d %s" % (n, s) for s, n in statuses.items())))
+    for task, status, _ in results:
+        if status != DONE:
+            print("%-10s %s" % (status, " ".join(task)))